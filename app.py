@@ -1,81 +1,171 @@
+import time
+_import_started = time.perf_counter()
+
 import logging
-from flask import Flask, request, abort
+from flask import Flask, request, abort, Response
+from werkzeug.exceptions import HTTPException
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, 
-    AudioMessage, ImageMessage, FileMessage
+    AudioMessage, ImageMessage, FileMessage, PostbackEvent
 )
-import tempfile
 import traceback
-from config import LINE_CHANNEL_SECRET, LINE_CHANNEL_ACCESS_TOKEN, FAMILY_USER_IDS
-from gsheet_manager import GSheetManager
+import threading
+from config import (
+    LINE_CHANNEL_SECRET, LINE_CHANNEL_ACCESS_TOKEN, FAMILY_USER_IDS,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, REPLY_TOKEN_TTL,
+    MEDIA_CHUNK_BYTES, MEDIA_SPOOL_BYTES, MEDIA_MAX_BYTES,
+    NOTIFY_WORKERS, NOTIFY_RATE, SCHEDULER_LOCK_PATH, LEADER_RETRY_INTERVAL,
+    LOG_LEVEL, LOG_JSON, LOG_SAMPLE_RATE, LOG_WEBHOOK_BODY,
+    EVENT_DEDUP_PATH, EVENT_DEDUP_TTL, EVENT_IN_FLIGHT_TTL, EVENT_DEDUP_MAX
+)
 from line_handler import LineHandler
-from gemini_manager import GeminiManager
 from prize_manager import prize_manager
-from flask_apscheduler import APScheduler
+from event_worker import EventWorker
+from media_buffer import MediaBuffer, MediaTooLarge
+from notifier import NotificationDispatcher
+from leader_election import LeaderElection
+from lazy import Lazy, record_timing
+import metrics
+from metrics import span, timed
+from log_setup import setup_logging, new_request_id, sampled
+from event_dedup import EventDedup, once_per_event
 import os
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+# 紀錄先進佇列，由背景執行緒寫出 (JSON)
+setup_logging(level=LOG_LEVEL, json_format=LOG_JSON)
 logger = app.logger
+webhook_logger = logging.getLogger('bookeep.webhook')
+
+def _create_gsheet():
+    # gspread / google-auth 只在第一次存取試算表時載入
+    from gsheet_manager import GSheetManager
+    return GSheetManager()
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+def _create_gemini():
+    # google-generativeai 載入最久 (約 1 秒)，等到第一次需要 AI 解析時才載入
+    from gemini_manager import GeminiManager
+    return GeminiManager()
+
+def _create_scheduler():
+    from flask_apscheduler import APScheduler
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    return scheduler
+
+# 外部服務的 client 都在第一次使用時才建立，縮短冷啟動時間
+line_bot_api = Lazy('line_bot_api', lambda: LineBotApi(LINE_CHANNEL_ACCESS_TOKEN))
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
-gsheet = GSheetManager()
-gemini = GeminiManager()
-scheduler = APScheduler()
+gsheet = Lazy('gsheet', _create_gsheet)
+gemini = Lazy('gemini', _create_gemini)
+scheduler = Lazy('scheduler', _create_scheduler)
+event_worker = EventWorker(max_workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_QUEUE_SIZE)
+# LINE 重送的事件只處理一次
+processed_events = Lazy('event_dedup', lambda: EventDedup(
+    EVENT_DEDUP_PATH, ttl=EVENT_DEDUP_TTL, in_flight_ttl=EVENT_IN_FLIGHT_TTL, max_entries=EVENT_DEDUP_MAX
+))
 
 @app.route("/", methods=['GET'])
 def index():
     return "Bookeep server is running! Version: 2.1.0", 200
 
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    # Prometheus 文字格式
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.after_request
+def count_request(response):
+    # 以路由樣板當標籤，避免掃描器打來的任意路徑讓指標數量暴增
+    path = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUESTS.inc(path=path, status=response.status_code)
+    return response
+
 @app.route("/test_env", methods=['GET'])
 def test_env():
     # 用於檢查環境變數是否正確讀入 (隱藏密鑰)
     sheets_id = os.getenv('GOOGLE_SHEETS_ID', 'Not Set')
     return f"Sheets ID set: {sheets_id[:5]}...", 200
 
+def build_win_message(user_id, wins):
+    """
+    將同一位使用者的中獎發票合併成一則推播
+    """
+    if len(wins) == 1:
+        w = wins[0]
+        text = f"🎊 【中獎喜報回傳】 🎊\n━━━━━━━━━━\n你於 {w['date']} 記錄的發票中獎囉！\n\n發票號碼：{w['invoice_number']}\n獎項：{w['prize']}\n\n趕快去領獎吧！🌸💰"
+    else:
+        lines = "\n\n".join(f"📅 {w['date']}\n發票號碼：{w['invoice_number']}\n獎項：{w['prize']}" for w in wins)
+        text = f"🎊 【中獎喜報回傳】 🎊\n━━━━━━━━━━\n你有 {len(wins)} 張發票中獎囉！\n\n{lines}\n\n趕快去領獎吧！🌸💰"
+    return TextSendMessage(text=text)
+
+def push_win_message(user_id, message):
+    with span('line_push'):
+        line_bot_api.push_message(user_id, message)
+
+win_notifier = NotificationDispatcher(
+    send=push_win_message,
+    build_message=build_win_message,
+    max_workers=NOTIFY_WORKERS,
+    rate=NOTIFY_RATE
+)
+
 #背景自動對獎任務
 def auto_check_prizes():
+    new_request_id()
     logger.info("⏰ Starting scheduled prize check...")
     try:
         # 1. 抓取最新開獎號碼
         prize_manager.fetch_winning_numbers()
         
-        # 2. 獲取試算表所有資料
-        sheet = gsheet.client.open_by_key(gsheet.spreadsheet_id).sheet1
-        records = sheet.get_all_records()
+        # 2. 只對已開獎期別中還沒對過的發票 (剛開獎的期別，或上次之後新增的發票)
+        checked_count = 0
+        for period in list(prize_manager.winning_numbers):
+            records = gsheet.get_unchecked_invoices(period, prize_manager.months_of_period(period))
+            if not records:
+                continue
+            results = prize_manager.check_prizes_batch([(r['invoice_number'], r['date']) for r in records])
+            gsheet.store.record_prize_results(period, [
+                (r['user_id'], r['invoice_number'], r['date'], msg if is_winner else None)
+                for r, (is_winner, msg) in zip(records, results)
+            ])
+            checked_count += len(records)
         
-        notified_count = 0
-        for i, r in enumerate(records):
-            # 取得發票號碼、日期、使用者 ID
-            # 注意：欄位順序可能是 Date, Cat, Amt, Note, User ID, Invoice Number
-            invoice_num = str(gsheet._get_val_by_idx(r, 5) or "").strip()
-            user_id = str(gsheet._get_val_by_idx(r, 4) or "").strip()
-            date = str(gsheet._get_val_by_idx(r, 0) or "").strip()
-            
-            if len(invoice_num) == 8 and user_id:
-                is_winner, msg = prize_manager.check_prize(invoice_num, invoice_date=date)
-                
-                # 如果中獎，且訊息中沒有「尚未開獎」字眼
-                if is_winner and "尚未開獎" not in msg:
-                    push_msg = f"🎊 【中獎喜報回傳】 🎊\n━━━━━━━━━━\n你於 {date} 記錄的發票中獎囉！\n\n發票號碼：{invoice_num}\n獎項：{msg}\n\n趕快去領獎吧！🌸💰"
-                    line_bot_api.push_message(user_id, TextSendMessage(text=push_msg))
-                    notified_count += 1
-                    logger.info(f"✅ Notified user {user_id} of a win!")
+        # 3. 依使用者合併推播中獎通知，成功後才標記，確保每張中獎發票只通知一次
+        delivered, stats = win_notifier.dispatch(gsheet.store.pending_notifications())
+        gsheet.store.mark_notified(delivered)
+        notified_count = len(delivered)
                     
-        logger.info(f"🏁 Scheduled check finished. Notified {notified_count} wins.")
+        logger.info(f"🏁 Scheduled check finished. Checked {checked_count} invoices, notified {notified_count} wins.")
     except Exception as e:
         logger.error(f"❌ Auto Prize Check Error: {e}")
 
-# 初始化並啟動排程 (單數月 25-27 號下午 4:00 執行，避開半夜與提早檢查)
-scheduler.init_app(app)
-scheduler.add_job(id='prize_check_job', func=auto_check_prizes, trigger='cron', month='1,3,5,7,9,11', day='25-27', hour=16, minute=0)
-scheduler.start()
+def start_leader_jobs():
+    """
+    只在當選 leader 的 worker 執行：預先更新開獎號碼並啟動排程
+    """
+    # 背景預先更新開獎號碼 (已是最新一期時不會連線)，使用者對獎只讀本地資料
+    threading.Thread(target=prize_manager.fetch_winning_numbers, daemon=True).start()
+    for job in SCHEDULED_JOBS:
+        scheduler.add_job(**job)
+    scheduler.start()
+
+# 週期性工作只在 leader 註冊並執行，新增工作時也不會隨 worker 數倍增
+SCHEDULED_JOBS = [
+    # 單數月 25-27 號下午 4:00 執行，避開半夜與提早檢查
+    dict(id='prize_check_job', func=auto_check_prizes, trigger='cron', month='1,3,5,7,9,11', day='25-27', hour=16, minute=0),
+]
+leader = LeaderElection(SCHEDULER_LOCK_PATH, retry_interval=LEADER_RETRY_INTERVAL)
+leader.start(start_leader_jobs)
 
 @app.errorhandler(Exception)
 def handle_error(e):
+    if isinstance(e, HTTPException):
+        # abort(400) 等正常的 HTTP 錯誤照原本的狀態碼回應，不算成未處理的例外
+        return e
+    metrics.ERRORS.inc(stage='unhandled')
     logger.error(f"!!! Unhandled Exception: {str(e)}")
     logger.error(traceback.format_exc())
     return "Internal Server Error", 500
@@ -85,92 +175,138 @@ def callback():
     # 獲取 X-Line-Signature 標頭值
     signature = request.headers.get('X-Line-Signature')
 
-    # 獲取請求實體
+    # 獲取請求實體 (內容含使用者 ID 與訊息，預設不寫入紀錄，只抽樣記下摘要)
     body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
+    new_request_id()
+    if LOG_WEBHOOK_BODY:
+        webhook_logger.debug("Webhook body", extra={'body': body})
+    if sampled(LOG_SAMPLE_RATE):
+        webhook_logger.info("Webhook received", extra={'bytes': len(body), 'events': body.count('"webhookEventId"')})
 
-    # 處理 Webhook 本體
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    # 驗證簽章後交給背景執行緒處理，立即回應 LINE
+    if not signature or not handler.parser.signature_validator.validate(body, signature):
         abort(400)
 
+    if not event_worker.submit(handler.handle, body, signature):
+        # 背景佇列已滿，直接在此處理
+        logger.warning("Webhook queue is full, handling inline.")
+        handler.handle(body, signature)
+
     return 'OK'
 
+def send_reply(event, message):
+    """
+    回覆訊息。背景處理可能讓 reply token 過期，
+    超過 REPLY_TOKEN_TTL 或 LINE 回報 token 無效時改用 push_message
+    """
+    age = time.time() - (event.timestamp or 0) / 1000
+    if age < REPLY_TOKEN_TTL:
+        try:
+            with span('line_reply'):
+                line_bot_api.reply_message(event.reply_token, message)
+            return
+        except LineBotApiError as e:
+            if e.status_code != 400:
+                raise
+            logger.warning(f"Reply token rejected ({e.error.message}), falling back to push.")
+    with span('line_push'):
+        line_bot_api.push_message(event.source.user_id, message)
+
+def send_detail_page(event, scope, month=None, cursor=None, start=1, category=None):
+    """
+    回覆一頁明細 (scope: me 為本人，family 為全家；category 為類別細目)
+    """
+    user_ids = FAMILY_USER_IDS if scope == 'family' else event.source.user_id
+    page = gsheet.get_items_page(user_ids, month=month, cursor=cursor, category=category)
+    if not isinstance(page, dict):
+        send_reply(event, TextSendMessage(text=page))
+        return
+    if not page['items']:
+        send_reply(event, TextSendMessage(text=f"你目前在 {page['month']} 還沒有任何記帳紀錄喔！"))
+        return
+    if category:
+        title = f"{category} 支出細目"
+    else:
+        title = f"{page['month']} 家庭明細" if scope == 'family' else f"{page['month']} 個人明細"
+    send_reply(event, LineHandler.get_detail_page_flex(title, page, scope=scope, start=start, category=category))
+
+@handler.add(PostbackEvent)
+@once_per_event(processed_events)
+@timed('handle_postback')
+def handle_postback(event):
+    metrics.WEBHOOK_EVENTS.inc(type='postback')
+    data = LineHandler.parse_postback(event.postback.data)
+    if data.get('action') == 'detail':
+        scope = 'family' if data.get('scope') == 'family' and FAMILY_USER_IDS else 'me'
+        send_detail_page(
+            event, scope, month=data.get('month'), cursor=data.get('cursor'),
+            start=int(data.get('start', 1)), category=data.get('category')
+        )
+
 @handler.add(MessageEvent, message=TextMessage)
+@once_per_event(processed_events)
+@timed('handle_text')
 def handle_text_message(event):
+    metrics.WEBHOOK_EVENTS.inc(type='text')
     user_id = event.source.user_id
     text = event.message.text
     
     # 優先嘗試處理系統指令
     if "使用教學" in text:
         reply = "🌸 Bookeep 使用小撇步：\n1. 直接打字「早餐 100」\n2. 對我說話「今天吃大餐花了一千」\n3. 拍收據或上傳帳單 PDF\n4. 點下方選單看「報表」唷！"
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+        send_reply(event, TextSendMessage(text=reply))
         return
 
     if "查詢ID" in text or "my id" in text.lower():
         reply = f"你的 LINE User ID 是：\n{user_id}\n\n(請將此 ID 提供給管理員以設定家庭共享)"
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+        send_reply(event, TextSendMessage(text=reply))
         return
 
     if any(keyword in text for keyword in ["全家", "全家報表", "家庭報表"]):
         if not FAMILY_USER_IDS:
             reply = "尚未設定家庭成員 ID。請在環境變數中設定 FAMILY_USER_IDS。"
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+            send_reply(event, TextSendMessage(text=reply))
             return
         
-        summary = gsheet.get_summary(FAMILY_USER_IDS, is_family=True)
+        summary = gsheet.get_summary(FAMILY_USER_IDS, is_family=True, include_items=False)
         if isinstance(summary, dict):
             reply_message = LineHandler.get_summary_flex(summary)
-            line_bot_api.reply_message(event.reply_token, reply_message)
+            send_reply(event, reply_message)
         else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=summary))
+            send_reply(event, TextSendMessage(text=summary))
         return
 
     if text.startswith("類別細目:"):
         target_cat = text.replace("類別細目:", "").strip()
-        summary = gsheet.get_summary(user_id)
-        if isinstance(summary, dict):
-            reply_message = LineHandler.get_detailed_list_flex(summary, filter_category=target_cat)
-            line_bot_api.reply_message(event.reply_token, reply_message)
-        else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=summary))
-        return
-
-    if any(keyword in text for keyword in ["詳細報表", "明細"]):
-        summary = gsheet.get_summary(user_id)
-        if isinstance(summary, dict):
-            reply_message = LineHandler.get_detailed_list_flex(summary)
-            line_bot_api.reply_message(event.reply_token, reply_message)
-        else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=summary))
+        send_detail_page(event, 'me', category=target_cat)
         return
 
     if any(keyword in text for keyword in ["家庭明細", "全家明細"]):
         if not FAMILY_USER_IDS:
             reply = "尚未設定家庭成員 ID。"
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+            send_reply(event, TextSendMessage(text=reply))
             return
-        
-        summary = gsheet.get_summary(FAMILY_USER_IDS, is_family=True)
-        if isinstance(summary, dict):
-            reply_message = LineHandler.get_detailed_list_flex(summary)
-            line_bot_api.reply_message(event.reply_token, reply_message)
-        else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=summary))
+
+        send_detail_page(event, 'family')
+        return
+
+    if any(keyword in text for keyword in ["詳細報表", "明細"]):
+        send_detail_page(event, 'me')
         return
 
     if any(keyword in text for keyword in ["摘要", "總額", "報表", "本月"]):
-        summary = gsheet.get_summary(user_id)
+        summary = gsheet.get_summary(user_id, include_items=False)
         if isinstance(summary, dict):
             reply_message = LineHandler.get_summary_flex(summary)
-            line_bot_api.reply_message(event.reply_token, reply_message)
+            send_reply(event, reply_message)
         else:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=summary))
+            send_reply(event, TextSendMessage(text=summary))
         return
     else:
-        # 使用 Gemini 解析文字
-        records = gemini.parse_bookkeeping_content(text_content=text)
+        # 簡單的「早餐 100」先在本地解析，沒把握時才交給 Gemini
+        records = LineHandler.parse_message(text)
+        if not records:
+            records = gemini.parse_bookkeeping_content(text_content=text)
         
         if records:
             success = gsheet.add_records(records, user_id)
@@ -179,19 +315,21 @@ def handle_text_message(event):
                     reply_message = LineHandler.get_batch_summary_flex(records)
                 else:
                     reply_message = LineHandler.get_flex_message(records[0])
-                line_bot_api.reply_message(event.reply_token, reply_message)
+                send_reply(event, reply_message)
                 return
             else:
                 reply = "❌ 記錄失敗，請檢查 Google Sheets 設定。"
         else:
             reply = "抱歉，我看不懂這筆帳。請嘗試輸入例如：\n「晚餐 100」\n「150 交通費」"
 
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    send_reply(event, TextSendMessage(text=reply))
 
 @handler.add(MessageEvent, message=(AudioMessage, ImageMessage, FileMessage))
+@once_per_event(processed_events)
+@timed('handle_content')
 def handle_content_message(event):
+    metrics.WEBHOOK_EVENTS.inc(type=event.message.type)
     user_id = event.source.user_id
-    message_content = line_bot_api.get_message_content(event.message.id)
     
     # 決定副檔名與 MIME 類型
     if isinstance(event.message, AudioMessage):
@@ -206,17 +344,26 @@ def handle_content_message(event):
     else:
         return
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as tf:
-        for chunk in message_content.iter_content():
-            tf.write(chunk)
-        temp_path = tf.name
+    too_large = f"抱歉，檔案太大了 (上限 {MEDIA_MAX_BYTES // (1024 * 1024)} MB)，請分開上傳喔！"
+    if isinstance(event.message, FileMessage) and (event.message.file_size or 0) > MEDIA_MAX_BYTES:
+        send_reply(event, TextSendMessage(text=too_large))
+        return
+
+    # 小檔案直接留在記憶體，大型 PDF 才寫到暫存檔
+    try:
+        with span('line_download'):
+            message_content = line_bot_api.get_message_content(event.message.id)
+            media = MediaBuffer.from_chunks(
+                message_content.iter_content(chunk_size=MEDIA_CHUNK_BYTES),
+                spool_bytes=MEDIA_SPOOL_BYTES, max_bytes=MEDIA_MAX_BYTES, suffix=f".{ext}"
+            )
+    except MediaTooLarge:
+        send_reply(event, TextSendMessage(text=too_large))
+        return
 
     # 使用 Gemini 解析多媒體內容
-    records = gemini.parse_bookkeeping_content(content_path=temp_path, mime_type=mime_type)
-    
-    # 刪除暫存檔
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
+    with media:
+        records = gemini.parse_bookkeeping_content(media=media, mime_type=mime_type)
 
     if records:
         success = gsheet.add_records(records, user_id)
@@ -225,14 +372,17 @@ def handle_content_message(event):
                 reply_message = LineHandler.get_batch_summary_flex(records)
             else:
                 reply_message = LineHandler.get_flex_message(records[0])
-            line_bot_api.reply_message(event.reply_token, reply_message)
+            send_reply(event, reply_message)
             return
         else:
             reply = "❌ 辨識成功但記錄失敗。"
     else:
         reply = "抱歉，我無法從這段內容中提取記帳資訊。"
 
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    send_reply(event, TextSendMessage(text=reply))
+
+record_timing('app.import', time.perf_counter() - _import_started)
+logger.info(f"🚀 App module loaded in {(time.perf_counter() - _import_started) * 1000:.0f}ms")
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 8080))
@@ -0,0 +1,109 @@
+"""
+Flex Message 產生速度與記憶體配置比較：
+- template：flex_templates 預先編譯的骨架直接產生 wire dict (目前的做法)
+- sdk：逐一呼叫 linebot SDK 的 BubbleContainer / BoxComponent / TextComponent ... 建出相同內容的物件樹，
+  再 as_json_dict() (原本 LineHandler 的做法；建構子的參數事先準備好，只量測建立物件與序列化)
+
+    python benchmarks/bench_flex.py [次數]
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linebot.models import (
+    FlexSendMessage, BubbleContainer, BoxComponent,
+    TextComponent, ButtonComponent, SeparatorComponent, MessageAction
+)
+import line_handler
+from line_handler import LineHandler
+
+
+class NoPrize:
+    def check_prize(self, invoice_number, invoice_date=None):
+        return False, "再接再厲，下一張就會中！💪"
+
+
+SUMMARY = {
+    'title': '消費月報', 'month': '2024-02', 'total': 4200.0, 'count': 40,
+    'category_details': {f'類別{i}': 100.0 * i for i in range(8)},
+    'budget': 5000.0, 'remaining': 800.0,
+    'items': [{'date': f'2024-02-{d % 28 + 1:02d} 12:00:00', 'category': f'類別{d % 8}', 'amount': d * 10} for d in range(40)],
+}
+RECORDS = [{'category': f'類別{i}', 'amount': i * 10} for i in range(12)]
+RECORD = {'category': '午餐', 'amount': 120, 'note': '便當', 'date': '2024-02-01', 'invoice_number': '12345678'}
+
+CASES = {
+    'get_summary_flex': lambda: LineHandler.get_summary_flex(SUMMARY),
+    'get_batch_summary_flex': lambda: LineHandler.get_batch_summary_flex(RECORDS),
+    'get_flex_message': lambda: LineHandler.get_flex_message(RECORD),
+}
+
+
+def template_path(build):
+    return build().as_json_dict()
+
+
+def to_snake_case(key):
+    return re.sub(r'(?<!^)([A-Z])', r'_\1', key).lower()
+
+
+SDK_CLASSES = {
+    'bubble': BubbleContainer, 'box': BoxComponent, 'text': TextComponent,
+    'button': ButtonComponent, 'separator': SeparatorComponent, 'message': MessageAction,
+}
+
+
+def _sdk_plan(node):
+    """
+    將 wire dict 轉成「呼叫哪個 SDK 類別、帶哪些參數」的建構計畫，執行時只剩建構子呼叫
+    """
+    if isinstance(node, list):
+        plans = [_sdk_plan(n) for n in node]
+        return lambda: [p() for p in plans]
+    if isinstance(node, dict):
+        cls = SDK_CLASSES[node['type']]
+        static = {to_snake_case(k): v for k, v in node.items() if k != 'type' and not isinstance(v, (dict, list))}
+        nested = [(to_snake_case(k), _sdk_plan(v)) for k, v in node.items() if isinstance(v, (dict, list))]
+        return lambda: cls(**static, **{k: p() for k, p in nested})
+    return lambda: node
+
+
+def sdk_path(payload):
+    bubble = _sdk_plan(payload['contents'])
+    alt_text = payload['altText']
+    return lambda: FlexSendMessage(alt_text=alt_text, contents=bubble()).as_json_dict()
+
+
+def measure(fn, n):
+    fn()
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    per_call = (time.perf_counter() - started) / n
+
+    tracemalloc.start()
+    fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_call, peak
+
+
+def main(n=2000):
+    line_handler.prize_manager = NoPrize()
+    print(f"{'builder':<26}{'template µs':>12}{'sdk µs':>10}{'speedup':>9}{'template KB':>13}{'sdk KB':>9}")
+    for name, build in CASES.items():
+        payload = build().as_json_dict()
+        sdk = sdk_path(payload)
+        assert sdk() == payload
+        t_time, t_peak = measure(lambda: template_path(build), n)
+        s_time, s_peak = measure(sdk, n)
+        print(f"{name:<26}{t_time * 1e6:>12.1f}{s_time * 1e6:>10.1f}{s_time / t_time:>8.1f}x"
+              f"{t_peak / 1024:>13.1f}{s_peak / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,226 @@
+"""
+基準測試與單元測試共用的離線替身：合成帳本、gspread Worksheet、Gemini、LINE 與財政部開獎網頁。
+每個替身都可以設定延遲 (毫秒)，模擬真實網路往返，但不會連到任何外部服務。
+"""
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+HEADER = ['Date', 'Category', 'Amount', 'Note', 'User ID', 'Invoice Number']
+CATEGORIES = ['早餐', '午餐', '晚餐', '交通', '購物', '娛樂', '日用品', '醫療', '房租', '水電', '咖啡', '點心']
+
+
+def _sleep(latency_ms):
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+
+
+def synthetic_rows(n, users=50, months=None, invoice_ratio=0.3, seed=0):
+    """
+    產生 n 列合成記帳資料 (與試算表相同的欄位順序，全部為字串)
+    months: ["YYYY-MM", ...]，資料平均分散在這些月份；invoice_ratio 為附發票號碼的比例
+    """
+    rng = random.Random(seed)
+    months = months or [datetime.now().strftime("%Y-%m")]
+    user_ids = [f"U{i:032d}" for i in range(users)]
+    rows = []
+    for _ in range(n):
+        month = rng.choice(months)
+        date = f"{month}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+        invoice = f"{rng.randint(0, 99999999):08d}" if rng.random() < invoice_ratio else ""
+        rows.append([
+            date, rng.choice(CATEGORIES), str(rng.randint(10, 3000)), "", rng.choice(user_ids), invoice
+        ])
+    return rows
+
+
+class FakeWorksheet:
+    """
+    模擬 gspread Worksheet：get_values / batch_get / append_row(s)，每次呼叫加上 latency_ms。
+    values 可以直接修改 (模擬其他人編輯試算表)，讀取時和 gspread 一樣一律回傳字串
+    """
+    def __init__(self, rows=None, latency_ms=0):
+        self.values = [HEADER] + [list(r) for r in (rows or [])]
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.full_reads = 0
+        self.tail_reads = 0
+
+    def _call(self):
+        self.calls += 1
+        _sleep(self.latency_ms)
+
+    @staticmethod
+    def _cells(rows):
+        return [[str(v) for v in r] for r in rows]
+
+    def get_values(self, range_name):
+        self._call()
+        self.full_reads += 1
+        return self._cells(self.values)
+
+    def batch_get(self, ranges):
+        # 只支援 sync() 用到的 ['A1:F1', 'A{n}:F'] 兩種範圍
+        self._call()
+        self.tail_reads += 1
+        start = int(ranges[1][1:].split(':')[0])
+        return [self._cells(self.values[:1]), self._cells(self.values[start - 1:])]
+
+    def append_row(self, row):
+        return self.append_rows([row])
+
+    def append_rows(self, rows):
+        self._call()
+        start = len(self.values) + 1
+        self.values.extend([list(r) for r in rows])
+        return {'updates': {'updatedRange': f"'工作表1'!A{start}:F{len(self.values)}"}}
+
+
+class FakeSheetsClient:
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.open_calls = 0
+
+    def open_by_key(self, key):
+        self.open_calls += 1
+        return self
+
+    @property
+    def sheet1(self):
+        return self.sheet
+
+
+class _Usage:
+    prompt_token_count = 800
+    candidates_token_count = 60
+
+
+class _GeminiResponse:
+    usage_metadata = _Usage()
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """
+    取代 genai.GenerativeModel：固定回傳 records_per_call 筆交易
+    """
+    def __init__(self, latency_ms=0, records_per_call=1):
+        self.latency_ms = latency_ms
+        self.records_per_call = records_per_call
+        self.calls = 0
+
+    def generate_content(self, contents):
+        self.calls += 1
+        _sleep(self.latency_ms)
+        today = datetime.now().strftime("%Y-%m-%d")
+        records = [
+            {"category": "午餐", "amount": 100 + i, "note": "", "date": today, "invoice_number": ""}
+            for i in range(self.records_per_call)
+        ]
+        return _GeminiResponse("```json\n" + json.dumps(records, ensure_ascii=False) + "\n```")
+
+
+class FakeLineBotApi:
+    """
+    取代 LineBotApi：記錄送出的訊息 (以 as_json_dict 序列化，和真的送出一樣)。
+    reply_error 不為 None 時 reply_message 一律拋出該例外 (模擬 reply token 失效)
+    """
+    def __init__(self, latency_ms=0, reply_error=None):
+        self.latency_ms = latency_ms
+        self.reply_error = reply_error
+        self.replies = []
+        self.pushes = []
+
+    @staticmethod
+    def _serialize(messages):
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        return json.dumps([m.as_json_dict() for m in messages])
+
+    def reply_message(self, reply_token, messages):
+        self._serialize(messages)
+        _sleep(self.latency_ms)
+        if self.reply_error:
+            raise self.reply_error
+        self.replies.append((reply_token, messages))
+
+    def push_message(self, to, messages):
+        self._serialize(messages)
+        _sleep(self.latency_ms)
+        self.pushes.append((to, messages))
+
+
+def recent_periods(count=2, today=None):
+    """
+    今天為止最近已開獎的 count 期 (例如 ["114年07-08月", "114年05-06月"])
+    """
+    from prize_manager import PrizeManager
+
+    today = today or datetime.now().date()
+    periods = []
+    for _ in range(count):
+        period = PrizeManager.latest_drawn_period(today)
+        periods.append(period)
+        # 往前推到上一期開獎日之前
+        start = PrizeManager.months_of_period(period)[0]
+        today = datetime.strptime(start + "-01", "%Y-%m-%d").date() - timedelta(days=1)
+    return periods
+
+
+def etax_html(winning):
+    """
+    依 { '114年07-08月': {'special', 'grand', 'first'} } 產生與財政部網頁相同結構的 HTML
+    """
+    blocks = []
+    for period, numbers in winning.items():
+        year, start, end = period[:3], period[4:6], period[7:9]
+        blocks.append(f"""
+  <h2 class="etw-period">{year}年 {start} ~ {end} 月</h2>
+  <table class="etw-table-bg">
+    <tr><th>獎別</th><th>中獎號碼</th></tr>
+    <tr><td>特別獎</td><td><span class="etw-color-red">{numbers['special']}</span></td></tr>
+    <tr><td>特獎</td><td><span class="etw-color-red">{numbers['grand']}</span></td></tr>
+    <tr><td>頭獎</td><td>
+{chr(10).join(numbers['first'])}
+    </td></tr>
+  </table>""")
+    return f'<!DOCTYPE html>\n<html lang="zh-Hant-TW">\n<head><meta charset="utf-8"></head>\n<body>{"".join(blocks)}\n</body>\n</html>'
+
+
+def random_winning_numbers(periods, seed=0):
+    rng = random.Random(seed)
+    number = lambda: f"{rng.randint(0, 99999999):08d}"
+    return {p: {'special': number(), 'grand': number(), 'first': [number() for _ in range(3)]} for p in periods}
+
+
+class EtaxResponse:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.encoding = None
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeEtax:
+    """
+    取代 prize_manager 中的 requests.get：回傳合成的開獎網頁，支援 ETag 條件式請求
+    """
+    def __init__(self, winning, latency_ms=0):
+        self.html = etax_html(winning)
+        self.etag = f'"{abs(hash(self.html))}"'
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls += 1
+        _sleep(self.latency_ms)
+        if (headers or {}).get('If-None-Match') == self.etag:
+            return EtaxResponse(304)
+        return EtaxResponse(200, self.html, {'ETag': self.etag})
@@ -0,0 +1,174 @@
+"""
+離線基準測試：以合成帳本與假的 Sheets / Gemini / LINE / 財政部網頁量測各項操作的
+吞吐量、p50 / p99 延遲與峰值記憶體。部署前執行，比對結果以發現規模變大時的效能退化。
+
+    python benchmarks/run_benchmarks.py --rows 10000,100000 --users 50 --latency-ms 20
+    python benchmarks/run_benchmarks.py --rows 1000000 --json result.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config 在第一次 import 時讀取環境變數，載入 app 需要有值 (不會真的連線)
+os.environ.setdefault("LINE_CHANNEL_SECRET", "benchmark")
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "benchmark")
+
+from fakes import (  # noqa: E402
+    synthetic_rows, FakeWorksheet, FakeSheetsClient, FakeGeminiModel, FakeLineBotApi,
+    FakeEtax, recent_periods, random_winning_numbers
+)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def measure(name, fn, iterations, repeatable=True):
+    """
+    先跑 iterations 次計時 (不開 tracemalloc，避免拖慢)，再跑一次量測峰值記憶體。
+    第二次執行結果會不同的操作 (repeatable=False，例如第一次對獎) 只跑一次，計時包含 tracemalloc 的開銷
+    """
+    if not repeatable:
+        tracemalloc.start()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+
+    if repeatable:
+        tracemalloc.start()
+        fn(iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "op": name,
+        "iterations": iterations,
+        "ops_per_sec": iterations / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+def load_app():
+    """
+    載入 app (只為了取用 auto_check_prizes)，不啟動排程也不連線
+    """
+    import leader_election
+    leader_election.LeaderElection.start = lambda self, on_elected: None
+    import app
+    # 排程的 INFO 紀錄會洗版
+    logging.disable(logging.INFO)
+    return app
+
+
+def run(rows, users, latency_ms, iterations, workdir):
+    import prize_manager as prize_module
+    from prize_manager import PrizeManager
+    from gsheet_manager import GSheetManager
+    from gemini_manager import GeminiManager
+    from line_handler import LineHandler
+    import line_handler
+
+    periods = recent_periods(2)
+    months = [m for p in periods for m in PrizeManager.months_of_period(p)]
+    data = synthetic_rows(rows, users=users, months=months)
+    user_ids = sorted({r[4] for r in data})
+    family = user_ids[:4]
+    target_month = months[0]
+
+    # 假的財政部網頁
+    etax = FakeEtax(random_winning_numbers(periods), latency_ms=latency_ms)
+    prize_module.requests.get = etax.get
+    pm = PrizeManager(db_path=os.path.join(workdir, "prize.db"))
+    line_handler.prize_manager = pm
+
+    # 假的 Sheets
+    sheet = FakeWorksheet(data, latency_ms=latency_ms)
+    gm = GSheetManager(db_path=os.path.join(workdir, "ledger.db"))
+    gm.client = FakeSheetsClient(sheet)
+
+    # 假的 Gemini
+    gemini = GeminiManager(cache_path=os.path.join(workdir, "gemini_cache.db"))
+    gemini.model = FakeGeminiModel(latency_ms=latency_ms)
+
+    line = FakeLineBotApi(latency_ms=latency_ms)
+    rng = random.Random(1)
+    invoices = [(r[5], r[0]) for r in data if r[5]]
+
+    results = []
+    few = max(1, iterations // 10)
+    results.append(measure("sheets.full_sync", lambda i: gm.sync(force=True), 1))
+    results.append(measure("sheets.tail_sync", lambda i: gm.sync(), iterations))
+    results.append(measure("get_summary.user", lambda i: gm.get_summary(rng.choice(user_ids), month=target_month, include_items=False), iterations))
+    results.append(measure("get_summary.family", lambda i: gm.get_summary(family, month=target_month, is_family=True, include_items=False), iterations))
+    results.append(measure("get_items_page.first", lambda i: gm.get_items_page(rng.choice(user_ids), month=target_month), iterations))
+    results.append(measure("get_items_page.category", lambda i: gm.get_items_page(rng.choice(user_ids), month=target_month, category="午餐"), iterations))
+    results.append(measure("prize.fetch", lambda i: pm.fetch_winning_numbers(force=True), few))
+    results.append(measure("prize.check_prize", lambda i: pm.check_prize(*rng.choice(invoices)), iterations))
+    results.append(measure("prize.check_batch_1k", lambda i: pm.check_prizes_batch(rng.sample(invoices, min(1000, len(invoices)))), few))
+
+    summary = gm.get_summary(user_ids[0], month=target_month, include_items=True)
+    page = gm.get_items_page(user_ids[0], month=target_month)
+    records = [{"category": r[1], "amount": r[2]} for r in data[:12]]
+    results.append(measure("flex.summary", lambda i: line.reply_message("t", LineHandler.get_summary_flex(summary)), iterations))
+    results.append(measure("flex.detail_page", lambda i: line.reply_message("t", LineHandler.get_detail_page_flex("明細", page)), iterations))
+    results.append(measure("flex.batch", lambda i: line.reply_message("t", LineHandler.get_batch_summary_flex(records)), iterations))
+    results.append(measure("flex.record", lambda i: line.reply_message("t", LineHandler.get_flex_message({"category": "午餐", "amount": 80, "date": invoices[0][1], "invoice_number": invoices[0][0]})), iterations))
+
+    results.append(measure("gemini.parse_miss", lambda i: gemini.parse_bookkeeping_content(text_content=f"午餐 {i} {time.time()}"), few))
+    results.append(measure("gemini.parse_hit", lambda i: gemini.parse_bookkeeping_content(text_content="午餐 100"), iterations))
+
+    app = load_app()
+    app.gsheet, app.line_bot_api, app.prize_manager = gm, line, pm
+    results.append(measure("auto_check_prizes.first", lambda i: app.auto_check_prizes(), 1, repeatable=False))
+    results.append(measure("auto_check_prizes.incremental", lambda i: app.auto_check_prizes(), few))
+    return results
+
+
+def print_table(rows, results):
+    print(f"\n=== {rows:,} rows ===")
+    print(f"{'operation':<32}{'iter':>6}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>12}")
+    for r in results:
+        print(f"{r['op']:<32}{r['iterations']:>6}{r['ops_per_sec']:>12.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['peak_kb']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bookeep offline benchmarks")
+    parser.add_argument("--rows", default="10000", help="以逗號分隔的帳本列數，例如 10000,100000,1000000")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每次呼叫假的外部服務時的延遲")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--json", help="將結果寫入 JSON 檔，方便與上次部署比對")
+    args = parser.parse_args()
+
+    report = {}
+    for rows in [int(n) for n in args.rows.split(",")]:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(rows, args.users, args.latency_ms, args.iterations, workdir)
+        print_table(rows, results)
+        report[rows] = results
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,3 +11,39 @@ PORT = int(os.getenv('PORT', 8080))
 FAMILY_USER_IDS = os.getenv('FAMILY_USER_IDS', '').split(',')
 FAMILY_USER_IDS = [f.strip() for f in FAMILY_USER_IDS if f.strip()]
 MONTHLY_BUDGET = float(os.getenv('MONTHLY_BUDGET', '5000'))
+LEDGER_DB_PATH = os.getenv('LEDGER_DB_PATH', 'ledger.db')
+LEDGER_SYNC_INTERVAL = int(os.getenv('LEDGER_SYNC_INTERVAL', '300'))  # 秒，與試算表全量對帳的間隔
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '4'))  # 遇到 429/503 時的重試次數
+SHEETS_BACKOFF_BASE = float(os.getenv('SHEETS_BACKOFF_BASE', '1.0'))  # 秒，指數退避的起始等待時間
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))  # 背景處理 webhook 的執行緒數
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '32'))  # 排隊中的 webhook 上限
+REPLY_TOKEN_TTL = int(os.getenv('REPLY_TOKEN_TTL', '50'))  # 秒，超過就改用 push_message 回覆
+GEMINI_CACHE_PATH = os.getenv('GEMINI_CACHE_PATH', 'gemini_cache.db')
+GEMINI_CACHE_MAX_MB = int(os.getenv('GEMINI_CACHE_MAX_MB', '50'))
+GEMINI_CACHE_TTL = int(os.getenv('GEMINI_CACHE_TTL', str(7 * 24 * 3600)))  # 秒
+MEDIA_CHUNK_BYTES = int(os.getenv('MEDIA_CHUNK_KB', '256')) * 1024  # 下載 LINE 多媒體內容的區塊大小
+MEDIA_SPOOL_BYTES = int(os.getenv('MEDIA_SPOOL_MB', '8')) * 1024 * 1024  # 超過才寫到暫存檔
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_MB', '30')) * 1024 * 1024  # 單一檔案上限
+GEMINI_MAX_PARALLEL = int(os.getenv('GEMINI_MAX_PARALLEL', '4'))  # 多頁帳單同時解析的段數上限
+PDF_PAGES_PER_CHUNK = int(os.getenv('PDF_PAGES_PER_CHUNK', '1'))
+TALL_IMAGE_RATIO = float(os.getenv('TALL_IMAGE_RATIO', '3'))  # 高度超過寬度幾倍視為長截圖
+RECEIPT_PREPROCESS = os.getenv('RECEIPT_PREPROCESS', '1') == '1'  # 收據照片上傳前先轉正、裁切、灰階、縮圖
+RECEIPT_MAX_EDGE = int(os.getenv('RECEIPT_MAX_EDGE', '1600'))  # 像素，長邊上限
+RECEIPT_JPEG_QUALITY = int(os.getenv('RECEIPT_JPEG_QUALITY', '75'))
+PRIZE_DB_PATH = os.getenv('PRIZE_DB_PATH', 'prize.db')
+PRIZE_FETCH_TIMEOUT = float(os.getenv('PRIZE_FETCH_TIMEOUT', '10'))  # 秒
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '4'))  # 同時推播中獎通知的執行緒數
+NOTIFY_RATE = float(os.getenv('NOTIFY_RATE', '20'))  # 每秒推播請求上限
+SCHEDULER_LOCK_PATH = os.getenv('SCHEDULER_LOCK_PATH', 'scheduler.lock')  # 選出唯一執行排程的 worker
+LEADER_RETRY_INTERVAL = int(os.getenv('LEADER_RETRY_INTERVAL', '30'))  # 秒，非 leader 重新競選的間隔
+STARTUP_BUDGET_MS = int(os.getenv('STARTUP_BUDGET_MS', '1500'))  # 冷啟動到第一個請求完成的預算 (startup_profile.py)
+DETAIL_PAGE_SIZE = int(os.getenv('DETAIL_PAGE_SIZE', '60'))  # 明細每次回覆的筆數 (分成數張卡片)
+DETAIL_ROWS_PER_BUBBLE = int(os.getenv('DETAIL_ROWS_PER_BUBBLE', '20'))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_JSON = os.getenv('LOG_JSON', '1') == '1'  # 以 JSON 格式輸出紀錄
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))  # webhook 摘要紀錄的抽樣比例
+LOG_WEBHOOK_BODY = os.getenv('LOG_WEBHOOK_BODY', '0') == '1'  # 除錯用，會在 DEBUG 等級寫出完整內容 (含使用者 ID)
+EVENT_DEDUP_PATH = os.getenv('EVENT_DEDUP_PATH', 'events.db')  # 已處理 webhook 事件的紀錄
+EVENT_DEDUP_TTL = int(os.getenv('EVENT_DEDUP_TTL', str(24 * 3600)))  # 秒，處理完的事件保留多久
+EVENT_IN_FLIGHT_TTL = int(os.getenv('EVENT_IN_FLIGHT_TTL', '600'))  # 秒，處理中的事件超過這個時間視為中斷，可重新處理
+EVENT_DEDUP_MAX = int(os.getenv('EVENT_DEDUP_MAX', '100000'))  # 最多保留的事件數
@@ -0,0 +1,124 @@
+import functools
+import logging
+import sqlite3
+import threading
+import time
+
+from metrics import DUPLICATE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+
+
+class EventDedup:
+    """
+    webhook 事件的冪等紀錄 (SQLite，多個 gunicorn worker 共用同一份)。
+    LINE 在回應太慢時會重送同一個事件；已處理完 (ttl 秒內) 或正在處理中 (in_flight_ttl 秒內) 的事件
+    不再重跑下載、Gemini 與寫入試算表。項目數超過 max_entries 時從最早到期的開始淘汰
+    """
+    PRUNE_EVERY = 100
+
+    def __init__(self, db_path, ttl=24 * 3600, in_flight_ttl=600, max_entries=100000):
+        self.ttl = ttl
+        self.in_flight_ttl = in_flight_ttl
+        self.max_entries = max_entries
+        self._claims = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_events (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    expires REAL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_expires ON webhook_events (expires)")
+
+    def claim(self, key):
+        """
+        取得處理權。事件第一次出現 (或先前的紀錄已過期) 時回傳 True；
+        重送的事件回傳 False。單一 upsert 完成判斷，不同 worker 同時收到也只有一個會成功
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            cur = self.conn.execute("""
+                INSERT INTO webhook_events (key, state, expires) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, expires = excluded.expires
+                WHERE webhook_events.expires <= ?
+            """, (key, IN_FLIGHT, now + self.in_flight_ttl, now))
+            claimed = cur.rowcount == 1
+            self._claims += 1
+            if self._claims % self.PRUNE_EVERY == 0:
+                self._prune(now)
+        return claimed
+
+    def done(self, key):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE webhook_events SET state = ?, expires = ? WHERE key = ?",
+                (DONE, time.time() + self.ttl, key)
+            )
+
+    def release(self, key):
+        """
+        處理失敗時放掉處理權，讓 LINE 重送時可以再試一次
+        """
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM webhook_events WHERE key = ?", (key,))
+
+    def state(self, key):
+        row = self.conn.execute(
+            "SELECT state FROM webhook_events WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _prune(self, now):
+        self.conn.execute("DELETE FROM webhook_events WHERE expires <= ?", (now,))
+        excess = self.conn.execute("SELECT COUNT(*) FROM webhook_events").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM webhook_events WHERE key IN (SELECT key FROM webhook_events ORDER BY expires LIMIT ?)",
+                (excess,)
+            )
+
+
+def event_key(event):
+    """
+    以 webhookEventId 識別事件；沒有時 (舊版 webhook) 退回訊息 ID
+    """
+    if getattr(event, 'webhook_event_id', None):
+        return event.webhook_event_id
+    message = getattr(event, 'message', None)
+    if message is not None and getattr(message, 'id', None):
+        return f"message:{message.id}"
+    return None
+
+
+def once_per_event(store):
+    """
+    handler 裝飾器：同一個事件只處理一次，重送的事件在做任何昂貴的工作之前就直接略過
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(event, *args, **kwargs):
+            key = event_key(event)
+            if key is None:
+                return fn(event, *args, **kwargs)
+            if not store.claim(key):
+                redelivery = bool(getattr(getattr(event, 'delivery_context', None), 'is_redelivery', False))
+                DUPLICATE_EVENTS.inc(redelivery=str(redelivery).lower())
+                logger.info(f"Skipping duplicate webhook event {key} (redelivery={redelivery})")
+                return None
+            try:
+                result = fn(event, *args, **kwargs)
+            except Exception:
+                store.release(key)
+                raise
+            store.done(key)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,46 @@
+import threading
+import traceback
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from metrics import ERRORS
+from log_setup import submit_with_context
+
+logger = logging.getLogger(__name__)
+
+
+class EventWorker:
+    """
+    以固定數量的背景執行緒處理 LINE webhook，讓 /callback 驗完簽章就能立即回應 200。
+    排隊中的工作數量有上限，滿了就由呼叫端自行同步處理 (退回原本的行為)，避免記憶體無限成長
+    """
+    def __init__(self, max_workers=4, max_pending=32):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhook')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        將工作放入背景執行；佇列已滿時回傳 False
+        """
+        if not self._slots.acquire(blocking=False):
+            return False
+        try:
+            # 帶著 request ID 等 contextvars 到背景執行緒
+            submit_with_context(self.executor, self._run, fn, *args, **kwargs)
+        except RuntimeError:
+            # executor 已關閉 (程序結束中)
+            self._slots.release()
+            return False
+        return True
+
+    def _run(self, fn, *args, **kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            ERRORS.inc(stage='event')
+            logger.error(f"!!! Background Event Error: {e}")
+            logger.error(traceback.format_exc())
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
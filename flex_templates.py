@@ -0,0 +1,243 @@
+"""
+Flex Message 樣板：卡片骨架在載入時預先編譯一次，每次回覆只填入變動的欄位，直接產生送出的 JSON dict，
+不再逐層建立 linebot SDK 的 BoxComponent / TextComponent 物件再序列化回去。
+"""
+
+
+class Slot:
+    """
+    樣板中的變動欄位，render 時以同名參數取代 (值可以是字串、數字或整個 contents 列表)
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _Builder:
+    __slots__ = ('build',)
+
+    def __init__(self, build):
+        self.build = build
+
+
+def _compile(node):
+    """
+    不含 Slot 的子樹原樣回傳 (每次 render 共用同一個物件，不再複製)；
+    含 Slot 的部分編成 _Builder，render 時只重建這條路徑上的 dict / list
+    """
+    if isinstance(node, Slot):
+        name = node.name
+        return _Builder(lambda values: values[name])
+    if isinstance(node, dict):
+        compiled = {k: _compile(v) for k, v in node.items()}
+        dynamic = tuple((k, v.build) for k, v in compiled.items() if isinstance(v, _Builder))
+        if not dynamic:
+            return node
+        static = {k: v for k, v in compiled.items() if not isinstance(v, _Builder)}
+
+        def build_dict(values):
+            d = static.copy()
+            for k, build in dynamic:
+                d[k] = build(values)
+            return d
+        return _Builder(build_dict)
+    if isinstance(node, list):
+        compiled = [_compile(v) for v in node]
+        if not any(isinstance(v, _Builder) for v in compiled):
+            return node
+        parts = tuple(compiled)
+
+        def build_list(values):
+            return [v.build(values) if isinstance(v, _Builder) else v for v in parts]
+        return _Builder(build_list)
+    return node
+
+
+class FlexTemplate:
+    def __init__(self, skeleton):
+        compiled = _compile(skeleton)
+        self._build = compiled.build if isinstance(compiled, _Builder) else (lambda values: compiled)
+
+    def render(self, **values):
+        return self._build(values)
+
+
+class RawFlexMessage:
+    """
+    直接以 wire 格式 dict 送出的 Flex Message；LineBotApi 只需要 as_json_dict()
+    """
+    type = 'flex'
+
+    def __init__(self, alt_text, contents):
+        self.alt_text = alt_text
+        self.contents = contents
+
+    def as_json_dict(self):
+        return {'type': 'flex', 'altText': self.alt_text, 'contents': self.contents}
+
+
+# 建立骨架用的小工具 (只在載入時執行)，輸出與 linebot SDK 序列化後相同的 camelCase 欄位
+def _props(props):
+    out = {}
+    for key, value in props.items():
+        head, *rest = key.split('_')
+        out[head + ''.join(w.title() for w in rest)] = value
+    return out
+
+
+def text(value, **props):
+    return {'type': 'text', 'text': value, **_props(props)}
+
+
+def box(layout, contents, **props):
+    return {'type': 'box', 'layout': layout, 'contents': contents, **_props(props)}
+
+
+def separator(**props):
+    return {'type': 'separator', **_props(props)}
+
+
+def button(label, message, **props):
+    return {'type': 'button', 'action': {'type': 'message', 'label': label, 'text': message}, **_props(props)}
+
+
+def postback_button(label, data, display_text, **props):
+    return {'type': 'button', 'action': {'type': 'postback', 'label': label, 'data': data, 'displayText': display_text}, **_props(props)}
+
+
+def bubble(header, body, footer=None):
+    b = {'type': 'bubble', 'direction': 'ltr', 'header': header, 'body': body}
+    if footer is not None:
+        b['footer'] = footer
+    return b
+
+
+# ---- 批次記帳成功 ----
+BATCH_PREVIEW_ROW = FlexTemplate(box('horizontal', [
+    text(Slot('category'), size='xs', color='#888888', flex=1),
+    text(Slot('amount'), size='xs', color='#555555', align='end', flex=2),
+]))
+
+BATCH_MORE = FlexTemplate(text(Slot('text'), size='xxs', color='#AAAAAA', align='center', margin='sm'))
+
+BATCH_SUMMARY = FlexTemplate(bubble(
+    header=box('vertical', [
+        text('📝 批次記帳成功 📝', weight='bold', size='md', color='#ffffff', align='center'),
+    ], background_color='#FFB2B2', padding_all='20px'),
+    body=box('vertical', [
+        text('總計匯入筆數', size='xs', color='#AAAAAA', align='center'),
+        text(Slot('count'), weight='bold', size='xl', color='#FF6B6B', align='center', margin='xs'),
+        text(Slot('total'), size='sm', color='#FF8888', align='center', margin='xs'),
+        separator(margin='xl', color='#FFEEEE'),
+        text('資料預覽：', size='xs', weight='bold', margin='md', color='#888888'),
+        box('vertical', Slot('rows'), margin='sm', spacing='xs'),
+    ], padding_all='20px'),
+    footer=box('vertical', [
+        text('已成功同步至 Google Sheets！✨', size='xxs', color='#FFB2B2', align='center', margin='md'),
+    ]),
+))
+
+# ---- 消費月報 ----
+CATEGORY_BUTTON = FlexTemplate(
+    button(Slot('label'), Slot('message'), style='secondary', color='#F0F0F0', margin='xs', height='sm')
+)
+
+SUMMARY = FlexTemplate(bubble(
+    header=box('vertical', [
+        text(Slot('title'), weight='bold', size='lg', color='#ffffff', align='center'),
+    ], background_color='#1DB446'),
+    body=box('vertical', [
+        text('總支出金額', size='xs', color='#AAAAAA', align='center'),
+        text(Slot('total'), weight='bold', size='xxl', margin='md', align='center', color='#1DB446'),
+        # 預算進度條
+        box('vertical', [
+            box('horizontal', [
+                text('預算進度', size='xs', color='#888888', flex=1),
+                text(Slot('percent'), size='xs', color='#888888', align='end', flex=1),
+            ]),
+            box('vertical', [
+                box('vertical', [], width=Slot('bar_width'), background_color=Slot('bar_color'), height='6px'),
+            ], margin='sm', background_color='#EEEEEE', height='6px'),
+            text(Slot('remaining'), size='xxs', color='#AAAAAA', margin='xs', align='end'),
+        ], margin='lg'),
+        separator(margin='xl'),
+        text('類別統計 (點擊看明細)', size='sm', weight='bold', margin='lg', color='#555555'),
+        box('vertical', Slot('categories'), margin='md', spacing='xs'),
+        separator(margin='xl'),
+        box('horizontal', [
+            text('總計筆數', size='xs', color='#AAAAAA', flex=1),
+            text(Slot('count'), size='xs', color='#AAAAAA', align='end', flex=4),
+        ], margin='md'),
+    ]),
+    footer=box('vertical', [
+        separator(margin='md'),
+        button(Slot('detail_label'), Slot('detail_message'), style='link', color='#1DB446', height='sm'),
+    ]),
+))
+
+# ---- 交易清單 ----
+DETAIL_ROW = FlexTemplate(box('horizontal', [
+    text(Slot('day'), size='xs', color='#AAAAAA', flex=1),
+    text(Slot('category'), size='sm', color='#555555', flex=2),
+    text(Slot('amount'), size='sm', color='#111111', align='end', flex=2),
+], margin='sm'))
+
+DETAIL_LIST = FlexTemplate(bubble(
+    header=box('vertical', [
+        text(Slot('title'), weight='bold', size='md', color='#ffffff', align='center'),
+    ], background_color='#1DB446'),
+    body=box('vertical', [
+        box('horizontal', [
+            text('編號', size='xs', color='#AAAAAA', flex=1),
+            text('項目', size='xs', color='#AAAAAA', flex=2),
+            text('金額', size='xs', color='#AAAAAA', align='end', flex=2),
+        ]),
+        separator(margin='sm'),
+        box('vertical', Slot('rows'), margin='md', spacing='sm'),
+    ]),
+))
+
+# 分頁明細：數張 DETAIL_LIST 組成 carousel，最後一張加上「下一頁」
+DETAIL_NEXT = FlexTemplate(box('vertical', [
+    separator(margin='md'),
+    postback_button('下一頁 ▶', Slot('data'), Slot('display_text'), style='link', color='#1DB446', height='sm'),
+]))
+
+CAROUSEL = FlexTemplate({'type': 'carousel', 'contents': Slot('bubbles')})
+
+# ---- 單筆記帳成功 ----
+RECORD_AMOUNT = FlexTemplate(box('vertical', [
+    text(Slot('amount'), weight='bold', size='xxl', color='#FF6B6B', align='center'),
+    text(Slot('comment'), size='xs', color='#FFAAAA', align='center', margin='sm'),
+], background_color='#FFF0F0', padding_all='15px'))
+
+RECORD_PRIZE = FlexTemplate(box('vertical', [
+    text(Slot('text'), size='xs', color=Slot('color'), wrap=True, align='center'),
+], margin='md', background_color='#FDFDFD', padding_all='10px', border_width='1px', border_color='#EEEEEE'))
+
+RECORD_DETAILS = FlexTemplate(box('vertical', [
+    box('horizontal', [
+        text('🐾 類別', size='sm', color='#888888', flex=1),
+        text(Slot('category'), size='sm', color='#555555', align='end', flex=4, weight='bold'),
+    ]),
+    box('horizontal', [
+        text('📝 備註', size='sm', color='#888888', flex=1),
+        text(Slot('note'), size='sm', color='#555555', align='end', flex=4),
+    ]),
+    separator(margin='md', color='#FFEEEE'),
+    box('horizontal', [
+        text('⏰ 時間', size='xs', color='#AAAAAA', flex=1),
+        text(Slot('date'), size='xs', color='#AAAAAA', align='end', flex=4),
+    ], margin='md'),
+], margin='xl', spacing='md'))
+
+RECORD = FlexTemplate(bubble(
+    header=box('vertical', [
+        text('🌸 記帳漂亮成功 🌸', weight='bold', size='md', color='#ffffff', align='center'),
+    ], background_color='#FFB2B2', padding_all='20px'),
+    body=box('vertical', Slot('contents'), padding_all='20px'),
+    footer=box('vertical', [
+        text('繼續保持唷！加油！🍰', size='xs', color='#FFB2B2', align='center', margin='md'),
+    ]),
+))
@@ -2,22 +2,48 @@ import google.generativeai as genai
 import os
 from datetime import datetime
 import json
+import hashlib
+import io
+import time
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    GEMINI_CACHE_PATH, GEMINI_CACHE_MAX_MB, GEMINI_CACHE_TTL,
+    GEMINI_MAX_PARALLEL, PDF_PAGES_PER_CHUNK, TALL_IMAGE_RATIO,
+    RECEIPT_PREPROCESS, RECEIPT_MAX_EDGE, RECEIPT_JPEG_QUALITY
+)
+from parse_cache import ParseCache
+from metrics import span, GEMINI_TOKENS
+from log_setup import submit_with_context
+from image_preprocess import preprocess_receipt
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class GeminiManager:
-    def __init__(self):
+    # 修改 prompt 時請遞增，舊的快取結果就不會再被使用
+    PROMPT_VERSION = "1"
+
+    def __init__(self, cache_path=GEMINI_CACHE_PATH):
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
         self.model = genai.GenerativeModel('gemini-flash-latest')
+        self.cache = ParseCache(cache_path, max_bytes=GEMINI_CACHE_MAX_MB * 1024 * 1024, ttl=GEMINI_CACHE_TTL)
 
-    def parse_bookkeeping_content(self, content_path=None, text_content=None, mime_type=None):
-        """
-        使用 Gemini 解析記帳內容。
-        支援文字、圖片 (收據、帳單截圖)、語音。
-        """
+    def _cache_key(self, digest, text_content, mime_type):
+        parts = [self.PROMPT_VERSION, mime_type or ""]
+        if digest:
+            parts.append(digest)
+        if text_content:
+            # 沒寫日期的文字會以「今天」記帳，所以 key 也要帶上日期
+            parts += [ParseCache.normalize_text(text_content), datetime.now().strftime("%Y-%m-%d")]
+        return ParseCache.make_key(*parts)
+
+    def _build_prompt(self, part_hint=""):
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        prompt = f"""
+        return f"""
         你是一位專業的記帳助理。請從提供的內容中提取記帳資訊。
         
         請注意：
@@ -33,7 +59,7 @@ class GeminiManager:
            }}
         4. 如果是整張收據，請提取總金額。
         5. 如果是信用卡帳單表格，請提取每一列的消費紀錄。
-        
+        {part_hint}
         回傳範例：
         [
           {{"category": "午餐", "amount": 150, "note": "麥當勞", "date": "2024-02-16"}},
@@ -41,36 +67,222 @@ class GeminiManager:
         ]
         """
 
-        contents = [prompt]
+    def _generate(self, contents):
+        """
+        呼叫 Gemini 並從回應中取出 JSON 列表
+        """
+        with span('gemini_generate'):
+            response = self.model.generate_content(contents)
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            logger.info(f"Gemini tokens: prompt={usage.prompt_token_count}, output={usage.candidates_token_count}")
+            GEMINI_TOKENS.inc(usage.prompt_token_count or 0, kind='prompt')
+            GEMINI_TOKENS.inc(usage.candidates_token_count or 0, kind='output')
+        text_response = response.text
+        # 提取 JSON 列表
+        if '```json' in text_response:
+            json_str = text_response.split('```json')[1].split('```')[0].strip()
+        else:
+            json_str = text_response.strip()
         
-        if content_path and os.path.exists(content_path):
+        result = json.loads(json_str)
+        # 確保回傳一定是列表
+        if isinstance(result, dict):
+            result = [result]
+        return result
+
+    @staticmethod
+    def _split_pdf(media):
+        """
+        多頁 PDF 依 PDF_PAGES_PER_CHUNK 頁切成數份；只有一頁 (或無法讀取，例如加密帳單) 時回傳 None
+        """
+        from pypdf import PdfReader, PdfWriter
+
+        reader = PdfReader(io.BytesIO(media.getvalue()) if media.in_memory else media.path)
+        page_count = len(reader.pages)
+        if page_count <= PDF_PAGES_PER_CHUNK:
+            return None
+        parts = []
+        for start in range(0, page_count, PDF_PAGES_PER_CHUNK):
+            writer = PdfWriter()
+            for page in reader.pages[start:start + PDF_PAGES_PER_CHUNK]:
+                writer.add_page(page)
+            buf = io.BytesIO()
+            writer.write(buf)
+            parts.append(("application/pdf", buf.getvalue()))
+        return parts
+
+    @staticmethod
+    def _split_tall_image(media):
+        """
+        超長截圖 (高度超過寬度 TALL_IMAGE_RATIO 倍) 切成數段，相鄰段落重疊 10% 避免切斷同一列
+        """
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(media.getvalue()))
+        width, height = img.size
+        if height <= width * TALL_IMAGE_RATIO:
+            return None
+        strip = width * 2
+        overlap = strip // 10
+        parts = []
+        top = 0
+        while True:
+            piece = img.crop((0, top, width, min(height, top + strip))).convert("RGB")
+            buf = io.BytesIO()
+            piece.save(buf, "JPEG", quality=90)
+            parts.append(("image/jpeg", buf.getvalue()))
+            if top + strip >= height:
+                break
+            top += strip - overlap
+        return parts
+
+    def _split_media(self, media, mime_type):
+        """
+        回傳 [(mime_type, bytes), ...]；不需要 (或無法) 拆分時回傳 None
+        """
+        try:
+            if mime_type == "application/pdf":
+                return self._split_pdf(media)
+            if mime_type and mime_type.startswith("image/"):
+                return self._split_tall_image(media)
+        except Exception as e:
+            logger.warning(f"Media Split Error: {e}")
+        return None
+
+    @staticmethod
+    def _merge_parts(results, overlap=False):
+        """
+        依序合併各段結果。overlap=True (長截圖切段，相鄰段落有重疊區域) 時，
+        相鄰兩段重複辨識到的同一筆交易只保留一次；PDF 各頁不重疊，同樣的交易出現在相鄰兩頁就是兩筆，全部保留
+        """
+        if not overlap:
+            return [r for records in results for r in records]
+
+        def key(r):
+            return (str(r.get('date')), str(r.get('amount')), str(r.get('category')), str(r.get('note')))
+
+        merged = []
+        previous = []
+        for records in results:
+            seen = Counter(key(r) for r in previous)
+            for r in records:
+                k = key(r)
+                if seen[k] > 0:
+                    seen[k] -= 1
+                    continue
+                merged.append(r)
+            previous = records
+        return merged
+
+    @staticmethod
+    def _preprocess_image(data, mime_type):
+        """
+        收據照片前處理，記錄處理前後的大小以便確認效益；失敗時沿用原圖
+        """
+        try:
+            out, stats = preprocess_receipt(data, max_edge=RECEIPT_MAX_EDGE, quality=RECEIPT_JPEG_QUALITY)
+        except Exception as e:
+            logger.warning(f"Image Preprocess Error: {e}")
+            return data, mime_type
+        logger.info(
+            f"Receipt preprocess: {stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+            f"{stats['size_before']} -> {stats['size_after']} px, cropped={stats['cropped']}"
+        )
+        return out, ("image/jpeg" if out is not data else mime_type)
+
+    def _parse_parts(self, parts, overlap=False):
+        """
+        以有限的執行緒數同時解析各段，任何一段失敗就回傳 None (改用整份解析，避免漏記)
+        """
+        total = len(parts)
+
+        def parse_one(indexed_part):
+            i, (part_mime, part_data) = indexed_part
+            hint = f"6. 這是一份多頁文件的第 {i + 1}/{total} 段，只需提取這一段中出現的交易。\n"
+            return self._generate([self._build_prompt(hint), {"mime_type": part_mime, "data": part_data}])
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(GEMINI_MAX_PARALLEL, total)) as pool:
+                # 帶著 request ID 進執行緒池，各段的紀錄才串得起來
+                futures = [submit_with_context(pool, parse_one, p) for p in enumerate(parts)]
+                results = [f.result() for f in futures]
+        except Exception as e:
+            logger.warning(f"Gemini Parallel Parsing Error: {e}")
+            return None
+        return self._merge_parts(results, overlap=overlap)
+
+    def parse_bookkeeping_content(self, content_path=None, text_content=None, mime_type=None, media=None):
+        """
+        使用 Gemini 解析記帳內容。
+        支援文字、圖片 (收據、帳單截圖)、語音。
+        media: MediaBuffer，記憶體內的內容直接放進請求；已寫到暫存檔的大檔案改用 File API 上傳。
+        多頁 PDF 與超長截圖會先拆開並行解析，再合併結果
+        """
+        contents = [self._build_prompt()]
+        data = None
+        digest = None
+        uploaded = None
+        
+        if media is not None:
+            digest = media.digest
+        elif content_path and os.path.exists(content_path):
             with open(content_path, "rb") as f:
                 data = f.read()
-            contents.append({
-                "mime_type": mime_type,
-                "data": data
-            })
-        
-        if text_content:
-            contents.append(text_content)
+            digest = hashlib.sha256(data).hexdigest()
 
+        # 相同內容已解析過就直接回傳，不再呼叫 Gemini
+        cache_key = self._cache_key(digest, text_content, mime_type)
         try:
-            response = self.model.generate_content(contents)
-            text_response = response.text
-            # 提取 JSON 列表
-            if '```json' in text_response:
-                json_str = text_response.split('```json')[1].split('```')[0].strip()
-            else:
-                json_str = text_response.strip()
-            
-            result = json.loads(json_str)
-            # 確保回傳一定是列表
-            if isinstance(result, dict):
-                return [result]
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning(f"Gemini Cache Error: {e}")
+
+        result = None
+        parts = self._split_media(media, mime_type) if media is not None and not text_content else None
+        if parts:
+            # 只有長截圖的切段會互相重疊
+            result = self._parse_parts(parts, overlap=mime_type.startswith("image/"))
+
+        try:
+            if result is None:
+                if media is not None and RECEIPT_PREPROCESS and mime_type and mime_type.startswith("image/"):
+                    payload, payload_mime = self._preprocess_image(media.getvalue(), mime_type)
+                    contents.append({"mime_type": payload_mime, "data": payload})
+                elif media is not None and not media.in_memory:
+                    with span('gemini_upload'):
+                        uploaded = genai.upload_file(media.path, mime_type=mime_type)
+                    contents.append(uploaded)
+                elif media is not None or data is not None:
+                    contents.append({
+                        "mime_type": mime_type,
+                        "data": media.getvalue() if media is not None else data
+                    })
+                
+                if text_content:
+                    contents.append(text_content)
+
+                started = time.time()
+                result = self._generate(contents)
+                logger.info(f"Gemini parse ({mime_type or 'text'}) took {time.time() - started:.2f}s")
+
+            if result:
+                try:
+                    self.cache.put(cache_key, result)
+                except Exception as e:
+                    logger.warning(f"Gemini Cache Error: {e}")
             return result
         except Exception as e:
-            print(f"Gemini Parsing Error: {e}")
+            logger.error(f"Gemini Parsing Error: {e}")
             return []
+        finally:
+            if uploaded is not None:
+                try:
+                    genai.delete_file(uploaded.name)
+                except Exception as e:
+                    logger.warning(f"Gemini File Cleanup Error: {e}")
 
 if __name__ == "__main__":
     # 簡單測試合法性
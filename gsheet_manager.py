@@ -1,14 +1,72 @@
 import gspread
 from google.oauth2.service_account import Credentials
 import os
+import re
+import json
+import time
+import random
+import logging
 from datetime import datetime
-from config import MONTHLY_BUDGET
+from config import (
+    MONTHLY_BUDGET, LEDGER_DB_PATH, LEDGER_SYNC_INTERVAL,
+    SHEETS_MAX_RETRIES, SHEETS_BACKOFF_BASE, DETAIL_PAGE_SIZE
+)
+from ledger_store import LedgerStore, LedgerRow
+from metrics import span, SHEETS_CALLS, SHEETS_RETRIES
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 定義可能的欄位名稱清單
+ID_KEYS = ['User ID', 'user_id', '使用者ID', '使用者 ID', 'UserID']
+AMOUNT_KEYS = ['Amount', 'amount', '金額', '消費']
+DATE_KEYS = ['Date', 'date', '日期', '時間']
+CATEGORY_KEYS = ['Category', 'category', '類別', '項目']
+NOTE_KEYS = ['Note', 'note', '備註', '說明']
+INVOICE_KEYS = ['Invoice Number', 'invoice_number', '發票號碼', '發票']
+
+# 欄位預設順序 (找不到標題時依此順序猜測)
+FIELDS = ['date', 'category', 'amount', 'note', 'user_id', 'invoice_number']
+FIELD_KEYS = {
+    'date': DATE_KEYS,
+    'category': CATEGORY_KEYS,
+    'amount': AMOUNT_KEYS,
+    'note': NOTE_KEYS,
+    'user_id': ID_KEYS,
+    'invoice_number': INVOICE_KEYS,
+}
+
+class LedgerSchema:
+    """
+    標題列 → 欄位位置的對照。每次讀取試算表只解析一次，之後逐列直接依位置取值
+    """
+    __slots__ = ('header', 'columns')
+
+    def __init__(self, header):
+        self.header = header
+        # 找不到標題時根據順序猜測 (Date=0, Cat=1, Amt=2, Note=3, ID=4, Invoice=5)
+        self.columns = tuple(
+            next((header.index(k) for k in FIELD_KEYS[field] if k in header), pos)
+            for pos, field in enumerate(FIELDS)
+        )
+
+    def decode(self, row_num, values):
+        n = len(values)
+        return LedgerRow(row_num, *[values[i] if i < n else None for i in self.columns])
+
+    def decode_all(self, first_row, rows):
+        return [self.decode(first_row + i, values) for i, values in enumerate(rows)]
+
+
+# 可重試的 Sheets API 狀態碼 (配額用盡 / 暫時無法服務)
+RETRYABLE_STATUS = (429, 500, 503)
+# append 不是冪等的：5xx 時 Sheets 可能已經寫入，重試會多出重複的列，只在 429 (請求被拒、確定沒寫入) 時重試
+APPEND_RETRYABLE_STATUS = (429,)
+
 class GSheetManager:
-    def __init__(self):
+    def __init__(self, db_path=LEDGER_DB_PATH):
         self.scope = [
             'https://www.googleapis.com/auth/spreadsheets',
             'https://www.googleapis.com/auth/drive'
@@ -16,25 +74,96 @@ class GSheetManager:
         self.credentials_file = os.getenv('GOOGLE_SERVICE_ACCOUNT_FILE', 'service_account.json')
         self.spreadsheet_id = os.getenv('GOOGLE_SHEETS_ID')
         self.client = self._authenticate()
+        self._sheet = None  # 快取 Worksheet handle，省去每次 open_by_key 的 metadata 往返
+        self._schema = None
+        self.store = LedgerStore(db_path)
 
     def _authenticate(self):
         try:
             creds = Credentials.from_service_account_file(self.credentials_file, scopes=self.scope)
             return gspread.authorize(creds)
         except Exception as e:
-            print(f"Error authenticating with Google Sheets: {e}")
+            logger.error(f"Error authenticating with Google Sheets: {e}")
+            return None
+
+    def _worksheet(self):
+        if self._sheet is None:
+            self._sheet = self.client.open_by_key(self.spreadsheet_id).sheet1
+        return self._sheet
+
+    @staticmethod
+    def _status_of(error):
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None) or getattr(error, 'code', None)
+
+    def _call(self, fn, stage='sheets_read', retry_on=RETRYABLE_STATUS):
+        """
+        以快取的 Worksheet 執行 fn(sheet)，每次呼叫都計入 stage 的耗時與呼叫次數。
+        - retry_on 中的狀態碼 (預設 429/500/503)：以加上隨機抖動的指數退避重試
+        - 401：憑證失效，重新驗證並清除快取的 handle 後再試一次
+        (一般的 token 到期由 google-auth 的 AuthorizedSession 自動更新)
+        """
+        reauthenticated = False
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            try:
+                SHEETS_CALLS.inc(stage=stage)
+                with span(stage):
+                    return fn(self._worksheet())
+            except gspread.exceptions.APIError as e:
+                status = self._status_of(e)
+                if status == 401 and not reauthenticated:
+                    reauthenticated = True
+                    self.client = self._authenticate() or self.client
+                    self._sheet = None
+                    continue
+                if status not in retry_on or attempt == SHEETS_MAX_RETRIES:
+                    raise
+                SHEETS_RETRIES.inc(status=status)
+                delay = SHEETS_BACKOFF_BASE * (2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                logger.warning(f"Sheets API returned {status}, retrying in {delay:.1f}s ({attempt + 1}/{SHEETS_MAX_RETRIES})")
+                time.sleep(delay)
+
+    @staticmethod
+    def _first_row_of(append_result):
+        """
+        從 append_row(s) 的回應 (updatedRange，例如 "'工作表1'!A10:F12") 取出起始列號
+        """
+        try:
+            updated_range = append_result['updates']['updatedRange']
+            return int(re.search(r'![A-Z]+(\d+)', updated_range).group(1))
+        except Exception:
             return None
 
+    def _write_through(self, append_result, rows):
+        """
+        將剛寫入試算表的資料同步寫進本地鏡像
+        """
+        try:
+            first_row = self._first_row_of(append_result)
+            if first_row is None:
+                self.store.mark_dirty()
+                return
+            # 只有緊接在已同步範圍之後才推進同步位置，否則交給下次 tail sync 補齊
+            meta = {}
+            if first_row == int(self.store.get_meta("synced_rows", "0")) + 1:
+                meta["synced_rows"] = first_row + len(rows) - 1
+            self.store.upsert_rows([LedgerRow(first_row + i, *row) for i, row in enumerate(rows)], meta=meta)
+        except Exception as e:
+            logger.error(f"Error writing through to local ledger: {e}")
+            self.store.mark_dirty()
+
     def add_record(self, date, category, amount, note, user_id, invoice_number=""):
         if not self.client:
             return False
-        
+
         try:
-            sheet = self.client.open_by_key(self.spreadsheet_id).sheet1
-            sheet.append_row([date, category, amount, note, user_id, invoice_number])
+            row = [date, category, amount, note, user_id, invoice_number]
+            result = self._call(lambda sheet: sheet.append_row(row), stage='sheets_append', retry_on=APPEND_RETRYABLE_STATUS)
+            self._write_through(result, [row])
             return True
         except Exception as e:
-            print(f"Error adding record to Google Sheets: {e}")
+            logger.error(f"Error adding record to Google Sheets: {e}")
             return False
 
     def add_records(self, records, user_id):
@@ -44,9 +173,8 @@ class GSheetManager:
         """
         if not self.client or not records:
             return False
-            
+
         try:
-            sheet = self.client.open_by_key(self.spreadsheet_id).sheet1
             rows = []
             for r in records:
                 rows.append([
@@ -57,92 +185,158 @@ class GSheetManager:
                     user_id,
                     r.get('invoice_number', "")
                 ])
-            sheet.append_rows(rows)
+            result = self._call(lambda sheet: sheet.append_rows(rows), stage='sheets_append', retry_on=APPEND_RETRYABLE_STATUS)
+            self._write_through(result, rows)
             return True
         except Exception as e:
-            print(f"Error adding batch records to Google Sheets: {e}")
+            logger.error(f"Error adding batch records to Google Sheets: {e}")
             return False
 
-    def get_summary(self, user_id_list, month=None, is_family=False):
+    @staticmethod
+    def _trim(row):
+        row = [str(v) for v in row]
+        while row and row[-1] == '':
+            row.pop()
+        return row
+
+    def _schema_for(self, header):
+        if self._schema is None or self._schema.header != header:
+            self._schema = LedgerSchema(header)
+        return self._schema
+
+    def _full_sync(self):
+        values = self._call(lambda sheet: sheet.get_values('A1:F'))
+        header = self._trim(values[0]) if values else []
+        rows = self._schema_for(header).decode_all(2, values[1:])  # 第 1 列為標題
+        self.store.replace_all(rows, meta={
+            "synced_rows": max(len(values), 1),
+            "header": json.dumps(header, ensure_ascii=False),
+        })
+
+    def sync(self, force=False):
+        """
+        與試算表同步本地鏡像。
+        平常只抓上次同步位置之後新增的列 (A{n}:F，多抓一列用來確認沒有被刪改)；
+        當列數變少、標題改變、或超過對帳間隔時才全量重建，讓手動修改也能反映到報表
+        """
+        synced_rows = int(self.store.get_meta("synced_rows", "0"))
+        if force or synced_rows < 1 or self.store.needs_full_sync(LEDGER_SYNC_INTERVAL):
+            return self._full_sync()
+
+        header_range, tail = self._call(lambda sheet: sheet.batch_get(['A1:F1', f'A{synced_rows}:F']))
+        header = self._trim(header_range[0]) if header_range else []
+        if header != json.loads(self.store.get_meta("header", "[]")) or not tail:
+            return self._full_sync()
+
+        schema = self._schema_for(header)
+        if synced_rows == 1:
+            anchor_ok = self._trim(tail[0]) == header
+        else:
+            anchor_ok = self.store.row_matches(schema.decode(synced_rows, tail[0]))
+        if not anchor_ok:
+            return self._full_sync()
+
+        new_rows = tail[1:]
+        if new_rows:
+            rows = schema.decode_all(synced_rows + 1, new_rows)
+            self.store.upsert_rows(rows, meta={"synced_rows": synced_rows + len(new_rows)})
+
+    def get_unchecked_invoices(self, period, months):
+        """
+        同步後取得某期還沒對過獎的發票 (供排程對獎使用)
+        """
+        if not self.client:
+            return []
+        self.sync()
+        return self.store.unchecked_invoices(period, months)
+
+    @staticmethod
+    def encode_cursor(row):
+        return f"{row['date']}|{row['row']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return None
+        date, _, row = cursor.rpartition('|')
+        return (date, int(row))
+
+    def get_items_page(self, user_id_list, month=None, cursor=None, limit=DETAIL_PAGE_SIZE, category=None):
+        """
+        分頁讀取明細 (由新到舊)，可只取單一類別。cursor 為上一頁回傳的 next_cursor，第一頁傳 None
+        回傳 { month, items, next_cursor }；next_cursor 為 None 代表沒有下一頁
+        """
+        if not self.client:
+            return "Error: Could not connect to Google Sheets."
+
+        id_list = [user_id_list] if isinstance(user_id_list, str) else user_id_list
+        target_month = month if month else datetime.now().strftime("%Y-%m")
+
+        try:
+            if cursor is None:
+                # 翻頁時沿用第一頁同步好的資料，避免每一頁都呼叫 Sheets API
+                self.sync()
+            # 多讀一筆來判斷是否還有下一頁
+            rows = self.store.query_page(
+                id_list, target_month, after=self.decode_cursor(cursor), limit=limit + 1, category=category
+            )
+            page = rows[:limit]
+            return {
+                "month": target_month,
+                "items": [
+                    {"date": r['date'], "category": r['category'], "amount": r['amount'], "note": r['note']}
+                    for r in page
+                ],
+                "next_cursor": self.encode_cursor(page[-1]) if len(rows) > limit else None
+            }
+        except Exception as e:
+            logger.error(f"Error getting items page: {e}")
+            return "無法獲取明細資料，請確認試算表格式。"
+
+    def get_summary(self, user_id_list, month=None, is_family=False, include_items=True):
         """
         獲取摘要。支持單一 ID 或 ID 列表。
+        合計直接讀取預先累加好的 rollup；家庭報表合併各成員 (已記憶) 的合計，
+        只有 include_items=True (明細報表) 才會讀取原始紀錄。
         """
         if not self.client:
             return "Error: Could not connect to Google Sheets."
-        
+
         # 統一轉為列表處理
         if isinstance(user_id_list, str):
             id_list = [user_id_list]
         else:
             id_list = user_id_list
 
+        target_month = month if month else datetime.now().strftime("%Y-%m")
+
         try:
-            sheet = self.client.open_by_key(self.spreadsheet_id).sheet1
-            records = sheet.get_all_records()
-            
-            if not records:
-                return f"你目前在 {target_month} 還沒有任何記帳紀錄喔！"
-                
+            self.sync()
+
             total = 0
             category_totals = {}
             count = 0
-            items = []  # 新增：儲存所有交易細目
-            
-            target_month = month if month else datetime.now().strftime("%Y-%m")
-
-            # 定義可能的欄位名稱清單
-            id_keys = ['User ID', 'user_id', '使用者ID', '使用者 ID', 'UserID']
-            amount_keys = ['Amount', 'amount', '金額', '消費']
-            date_keys = ['Date', 'date', '日期', '時間']
-            category_keys = ['Category', 'category', '類別', '項目']
-
-            def get_value(row_dict, keys, default_idx):
-                for k in keys:
-                    if k in row_dict:
-                        return row_dict[k]
-                # 如果都找不到，嘗試根據順序猜測 (Date=0, Cat=1, Amt=2, Note=3, ID=4)
-                vals = list(row_dict.values())
-                if len(vals) > default_idx:
-                    return vals[default_idx]
-                return None
-
-            def _get_val_by_idx(row_dict, idx):
-                vals = list(row_dict.values())
-                return vals[idx] if len(vals) > idx else None
-            self._get_val_by_idx = _get_val_by_idx # 導出給外部使用
+            for r in self.store.query_rollup(id_list, target_month):
+                total += r.total
+                count += r.count
+                category_totals[r.category] = r.total
+
+            items = []  # 儲存所有交易細目
+            if include_items:
+                for r in self.store.query_month(id_list, target_month):
+                    items.append({
+                        "date": r['date'],
+                        "category": r['category'],
+                        "amount": r['amount'],
+                        "note": r['note']
+                    })
 
-            for r in records:
-                r_user_id = str(get_value(r, id_keys, 4) or "")
-                r_amount = get_value(r, amount_keys, 2)
-                r_date = str(get_value(r, date_keys, 0) or "")
-                
-                # 檢查 User ID 是否在清單中
-                if r_user_id in id_list and r_date.startswith(target_month):
-                    try:
-                        amt = float(r_amount)
-                        total += amt
-                        count += 1
-                        
-                        # 按類別統計
-                        cat = str(get_value(r, category_keys, 1) or '未分類')
-                        category_totals[cat] = category_totals.get(cat, 0) + amt
-
-                        # 儲存明細
-                        items.append({
-                            "date": r_date,
-                            "category": cat,
-                            "amount": amt,
-                            "note": str(get_value(r, ['Note', 'note', '備註', '說明'], 3) or "")
-                        })
-                    except (ValueError, TypeError):
-                        continue
-            
             if count == 0:
                 return f"你目前在 {target_month} 還沒有任何記帳紀錄喔！"
-            
+
             title = f"{target_month} 家庭合併報表" if is_family else f"{target_month} 個人報表"
             cat_details = "\n".join([f"• {k}: {v}元" for k, v in category_totals.items()])
-            
+
             return {
                 "title": title,
                 "month": target_month,
@@ -155,5 +349,5 @@ class GSheetManager:
                 "text_summary": f"📊 {title}：\n━━━━━━━━━━\n預算：{MONTHLY_BUDGET}\n總支出：{total} 元\n剩餘：{MONTHLY_BUDGET - total} 元\n筆數：{count} 筆\n\n類別明細：\n{cat_details}"
             }
         except Exception as e:
-            print(f"Error getting summary: {e}")
+            logger.error(f"Error getting summary: {e}")
             return "無法獲取摘要資料，請確認試算表格式。"
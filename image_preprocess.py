@@ -0,0 +1,62 @@
+import io
+
+
+def _document_bbox(gray, min_area_ratio=0.08):
+    """
+    在縮小的灰階圖上找出明亮的收據區域 (紙張通常比桌面亮)，回傳原圖座標的 bbox；
+    找不到或範圍太小 (可能誤判) 時回傳 None
+    """
+    from PIL import ImageFilter
+
+    width, height = gray.size
+    scale = 128 / max(width, height)
+    small = gray.resize((max(1, int(width * scale)), max(1, int(height * scale))))
+    small = small.filter(ImageFilter.MedianFilter(5))
+    darkest, brightest = small.getextrema()
+    threshold = (darkest + brightest) / 2
+    bbox = small.point(lambda p: 255 if p > threshold else 0).getbbox()
+    if not bbox:
+        return None
+    left, top, right, bottom = bbox
+    if (right - left) * (bottom - top) < min_area_ratio * small.size[0] * small.size[1]:
+        return None
+    # 放回原圖尺寸並保留一點邊界
+    margin = 2
+    return (
+        max(0, int((left - margin) / scale)),
+        max(0, int((top - margin) / scale)),
+        min(width, int((right + margin) / scale)),
+        min(height, int((bottom + margin) / scale)),
+    )
+
+
+def preprocess_receipt(data, max_edge=1600, quality=75):
+    """
+    收據照片上傳 Gemini 前的前處理：
+    EXIF 轉正 → 裁切到收據範圍 → 灰階 → 長邊縮到 max_edge → 以指定品質重新壓縮 JPEG
+    回傳 (bytes, stats)；處理後反而變大時沿用原始資料
+    """
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(data))
+    stats = {"bytes_before": len(data), "size_before": img.size}
+
+    img = ImageOps.exif_transpose(img)
+    gray = ImageOps.grayscale(img)
+    bbox = _document_bbox(gray)
+    if bbox:
+        gray = gray.crop(bbox)
+    if max(gray.size) > max_edge:
+        gray.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    buf = io.BytesIO()
+    gray.save(buf, "JPEG", quality=quality, optimize=True)
+    out = buf.getvalue()
+    if len(out) >= len(data):
+        out = data
+        stats["size_after"] = stats["size_before"]
+    else:
+        stats["size_after"] = gray.size
+    stats["bytes_after"] = len(out)
+    stats["cropped"] = bbox is not None
+    return out, stats
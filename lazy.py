@@ -0,0 +1,46 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 啟動各階段耗時 (秒)：模組載入，以及各個 Lazy 物件第一次建立時花的時間
+STARTUP_TIMINGS = {}
+
+
+def record_timing(name, seconds):
+    STARTUP_TIMINGS[name] = round(seconds, 4)
+
+
+class Lazy:
+    """
+    第一次使用時才建立的物件代理，縮短冷啟動時間：
+    - 屬性存取會轉給真正的物件，呼叫端不需要改寫
+    - 多個執行緒同時第一次使用時只會建立一次
+    - 建立耗時記錄在 STARTUP_TIMINGS
+    """
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self):
+        return self._instance is not None
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    instance = self._factory()
+                    elapsed = time.perf_counter() - started
+                    record_timing(self._name, elapsed)
+                    logger.info(f"⏱️ Lazy init {self._name} took {elapsed * 1000:.0f}ms")
+                    self._instance = instance
+        return self._instance
+
+    def __getattr__(self, attr):
+        # 只有一般屬性會走到這裡 (_name 等內部屬性已在 __init__ 設定)
+        return getattr(self.get(), attr)
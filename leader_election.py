@@ -0,0 +1,77 @@
+import fcntl
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """
+    gunicorn 多個 worker 之間以檔案鎖選出唯一的 leader，只有 leader 執行排程工作。
+    - 鎖綁在開啟的檔案上，leader 程序結束 (包含被 kill) 時作業系統會自動釋放
+    - 其他 worker 每隔 retry_interval 秒重試一次，leader 掛掉後由其中一個接手
+    檔案鎖只能協調同一台主機上的程序；請勿搭配 gunicorn --preload (fork 後子程序會共用同一把鎖)
+    """
+    def __init__(self, lock_path, retry_interval=30):
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        """
+        嘗試取得鎖 (不等待)，成功回傳 True
+        """
+        if self._file is not None:
+            return True
+        f = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        # 記下目前 leader 的 pid，方便排查
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def start(self, on_elected):
+        """
+        在背景執行緒中競選，當選後呼叫 on_elected() (只會呼叫一次)
+        """
+        def run():
+            while not self._stop.is_set():
+                if self.try_acquire():
+                    logger.info(f"👑 Process {os.getpid()} is now the scheduler leader")
+                    try:
+                        on_elected()
+                    except Exception as e:
+                        logger.error(f"❌ Leader startup error: {e}")
+                    return
+                self._stop.wait(self.retry_interval)
+
+        self._thread = threading.Thread(target=run, name="leader-election", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self.release()
@@ -0,0 +1,392 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# query_rollup 的結果：某類別的合計與筆數
+CategoryTotal = namedtuple('CategoryTotal', ['category', 'total', 'count'])
+
+
+class LedgerRow:
+    """
+    單列記帳紀錄。使用 __slots__，大量解碼時不必為每一列建立 dict
+    """
+    __slots__ = ('row', 'date', 'category', 'amount', 'note', 'user_id', 'invoice_number')
+
+    def __init__(self, row, date, category, amount, note, user_id, invoice_number=""):
+        self.row = row  # 試算表列號
+        self.date = date
+        self.category = category
+        self.amount = amount
+        self.note = note
+        self.user_id = user_id
+        self.invoice_number = invoice_number
+
+
+class LedgerStore:
+    """
+    Google Sheets 記帳資料的本地 SQLite 鏡像
+    以 (user_id, 月份) 建立索引，報表直接查本地資料，不必每次重讀整張試算表
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # 每位成員每月的類別合計 { (user_id, month): [(category, total, count, first_row), ...] }
+        # 本程序寫入時清掉受影響的項目；其他程序寫入 (data_version 改變) 時全部清掉
+        self._member_cache = {}
+        self._data_version = None
+        # 對獎查詢當下的發票版本 { period: revision }，記錄結果時一併寫入 prize_periods
+        self._checked_revision = {}
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ledger (
+                    row INTEGER PRIMARY KEY,   -- 試算表列號 (第 1 列為標題)
+                    date TEXT,
+                    month TEXT,                -- YYYY-MM
+                    category TEXT,
+                    amount REAL,               -- 無法轉成數字時為 NULL
+                    note TEXT,
+                    user_id TEXT,
+                    invoice_number TEXT
+                )
+            """)
+            # 明細依日期分頁，(user_id, month) 的查詢也會用到這個索引的前綴
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_month_date ON ledger (user_id, month, date, row)")
+            # 類別細目：只讀該類別的紀錄，與其他類別或月份的資料量無關
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ledger_user_month_category ON ledger (user_id, month, category, date, row)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            has_rollup = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup'"
+            ).fetchone()
+            # 每位使用者、每月、每個類別的合計與筆數，寫入時即時累加
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollup (
+                    user_id TEXT,
+                    month TEXT,
+                    category TEXT,
+                    total REAL,
+                    count INTEGER,
+                    first_row INTEGER,         -- 類別首次出現的列號，用來維持原本的顯示順序
+                    PRIMARY KEY (user_id, month, category)
+                )
+            """)
+            if not has_rollup:
+                self._rebuild_rollup()
+            # 發票依月份索引 (一期 = 兩個月)，排程對獎只讀剛開獎期別的發票
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ledger_invoice_month ON ledger (month) WHERE length(invoice_number) = 8"
+            )
+            # 已對過獎的發票 (每張發票每期只對一次、中獎只通知一次)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS prize_checked (
+                    user_id TEXT,
+                    invoice_number TEXT,
+                    period TEXT,
+                    date TEXT,
+                    prize TEXT,                -- 中獎訊息，沒中為 NULL
+                    notified INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_id, invoice_number, period)
+                )
+            """)
+            # 每期對完獎時的發票版本 (meta 的 invoice_revision)；之後發票沒有變動就不必再查這一期
+            self.conn.execute("CREATE TABLE IF NOT EXISTS prize_periods (period TEXT PRIMARY KEY, checked_at REAL, revision INTEGER)")
+
+    @staticmethod
+    def to_amount(value):
+        try:
+            return float(str(value).replace(',', ''))
+        except (ValueError, TypeError):
+            return None
+
+    def _row_tuple(self, r):
+        date = str(r.date or "")
+        return (
+            r.row, date, date[:7], str(r.category or '未分類'), self.to_amount(r.amount),
+            str(r.note or ""), str(r.user_id or "").strip(), str(r.invoice_number or "").strip()
+        )
+
+    def upsert_rows(self, rows, meta=None):
+        """
+        寫入 (或覆蓋) 多列資料
+        rows: [LedgerRow, ...]
+        """
+        data = [self._row_tuple(r) for r in rows]
+        with self._lock, self.conn:
+            invoices_changed = False
+            for t in data:
+                old = self.conn.execute(
+                    "SELECT row, date, month, category, amount, user_id, invoice_number FROM ledger WHERE row = ?", (t[0],)
+                ).fetchone()
+                old_invoice = self._invoice_key(old['row'], old['date'], old['user_id'], old['invoice_number']) if old else None
+                if old_invoice != self._invoice_key(t[0], t[1], t[6], t[7]):
+                    invoices_changed = True
+                if old:
+                    self._bump_rollup(old['user_id'], old['month'], old['category'], old['amount'], old['row'], -1)
+                    self._member_cache.pop((old['user_id'], old['month']), None)
+                self._bump_rollup(t[6], t[2], t[3], t[4], t[0], 1)
+                self._member_cache.pop((t[6], t[2]), None)
+            self.conn.executemany("INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)", data)
+            if invoices_changed:
+                self._bump_revision()
+            for key, value in (meta or {}).items():
+                self._set_meta(key, str(value))
+
+    def replace_all(self, rows, meta=None):
+        """
+        全量重建 (與試算表對帳用)，meta 會在同一個交易內一併寫入
+        """
+        data = [self._row_tuple(r) for r in rows]
+        # 發票相關欄位的摘要，全量對帳沒有改到發票時不必讓已對完的期別重查
+        digest = hashlib.sha1()
+        for t in data:
+            key = self._invoice_key(t[0], t[1], t[6], t[7])
+            if key:
+                digest.update(repr(key).encode())
+        digest = digest.hexdigest()
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM ledger")
+            self.conn.executemany("INSERT INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)", data)
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'invoice_digest'").fetchone()
+            if not row or row[0] != digest:
+                self._bump_revision()
+                self._set_meta("invoice_digest", digest)
+            self._rebuild_rollup()
+            self._member_cache.clear()
+            for key, value in (meta or {}).items():
+                self._set_meta(key, str(value))
+            self._set_meta("last_full_sync", str(time.time()))
+            self._set_meta("dirty", "0")
+
+    def _bump_rollup(self, user_id, month, category, amount, row_num, sign):
+        """
+        累加 (sign=1) 或扣除 (sign=-1) 單筆紀錄對 rollup 的貢獻
+        """
+        if amount is None:
+            return
+        self.conn.execute("""
+            INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, month, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + excluded.count,
+                first_row = MIN(first_row, excluded.first_row)
+        """, (user_id, month, category, sign * amount, sign, row_num))
+        if sign < 0:
+            self.conn.execute(
+                "DELETE FROM rollup WHERE user_id = ? AND month = ? AND category = ? AND count <= 0",
+                (user_id, month, category)
+            )
+
+    def _rebuild_rollup(self):
+        self.conn.execute("DELETE FROM rollup")
+        self.conn.execute("""
+            INSERT INTO rollup
+            SELECT user_id, month, category, SUM(amount), COUNT(*), MIN(row) FROM ledger
+            WHERE amount IS NOT NULL GROUP BY user_id, month, category
+        """)
+
+    def member_rollups(self, user_ids, month):
+        """
+        取得每位成員在某月份的類別合計 { user_id: [(category, total, count, first_row), ...] }
+        已算過的成員直接用記憶的結果，其餘成員以一次查詢補齊
+        """
+        with self._lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._member_cache.clear()
+                self._data_version = version
+
+            result = {}
+            misses = []
+            for user_id in user_ids:
+                cached = self._member_cache.get((user_id, month))
+                if cached is None:
+                    misses.append(user_id)
+                else:
+                    result[user_id] = cached
+            if misses:
+                fresh = {user_id: [] for user_id in misses}
+                placeholders = ",".join("?" * len(misses))
+                for r in self.conn.execute(
+                    f"SELECT user_id, category, total, count, first_row FROM rollup "
+                    f"WHERE user_id IN ({placeholders}) AND month = ? AND count > 0",
+                    (*misses, month)
+                ):
+                    fresh[r['user_id']].append((r['category'], r['total'], r['count'], r['first_row']))
+                for user_id, rows in fresh.items():
+                    self._member_cache[(user_id, month)] = rows
+                result.update(fresh)
+        return result
+
+    def query_rollup(self, user_ids, month):
+        """
+        取得指定使用者在某月份的類別合計，回傳 [CategoryTotal, ...] (依類別首次出現的順序)
+        合併各成員的合計，成本與成員數 × 類別數成正比，不會碰到原始明細
+        """
+        merged = {}
+        for rows in self.member_rollups(dict.fromkeys(user_ids), month).values():
+            for category, total, count, first_row in rows:
+                m = merged.get(category)
+                if m is None:
+                    merged[category] = [total, count, first_row]
+                else:
+                    m[0] += total
+                    m[1] += count
+                    m[2] = min(m[2], first_row)
+        ordered = sorted(merged.items(), key=lambda kv: kv[1][2])
+        return [CategoryTotal(category, total, count) for category, (total, count, _) in ordered]
+
+    def query_month(self, user_ids, month):
+        """
+        取得指定使用者在某月份的所有有效紀錄 (依試算表順序)
+        """
+        placeholders = ",".join("?" * len(user_ids))
+        sql = (
+            f"SELECT row, date, category, amount, note, user_id, invoice_number FROM ledger "
+            f"WHERE user_id IN ({placeholders}) AND month = ? AND amount IS NOT NULL ORDER BY row"
+        )
+        with self._lock:
+            return self.conn.execute(sql, (*user_ids, month)).fetchall()
+
+    def query_page(self, user_ids, month, after=None, limit=20, category=None):
+        """
+        依日期由新到舊分頁讀取某月份的紀錄。after 為上一頁最後一筆的 (date, row)，
+        沿著 (user_id, month, date, row) 索引往下讀 limit 筆，翻到第 N 頁也不必重掃整個月份；
+        指定 category 時改走 (user_id, month, category, date, row) 索引，只讀該類別的紀錄
+        """
+        placeholders = ",".join("?" * len(user_ids))
+        sql = (
+            f"SELECT row, date, category, amount, note FROM ledger "
+            f"WHERE user_id IN ({placeholders}) AND month = ? AND amount IS NOT NULL"
+        )
+        params = [*user_ids, month]
+        if category is not None:
+            sql += " AND category = ?"
+            params.append(category)
+        if after:
+            sql += " AND (date, row) < (?, ?)"
+            params += [after[0], int(after[1])]
+        sql += " ORDER BY date DESC, row DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def row_matches(self, row):
+        """
+        檢查本地同一列是否與試算表上的資料一致 (用來偵測列被刪除或位移)
+        """
+        expected = self._row_tuple(row)
+        with self._lock:
+            got = self.conn.execute("SELECT * FROM ledger WHERE row = ?", (row.row,)).fetchone()
+        return got is not None and tuple(got) == expected
+
+    @staticmethod
+    def _invoice_key(row_num, date, user_id, invoice_number):
+        """
+        對獎會用到的欄位；沒有 8 碼發票號碼的列為 None
+        """
+        if len(invoice_number or "") != 8:
+            return None
+        return (row_num, date, user_id, invoice_number)
+
+    def _revision(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'invoice_revision'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_revision(self):
+        """
+        發票有新增或變動時遞增版本 (在呼叫端的交易內)
+        """
+        self._set_meta("invoice_revision", str(self._revision() + 1))
+
+    def _mark_period_checked(self, period, revision):
+        self.conn.execute("INSERT OR REPLACE INTO prize_periods VALUES (?, ?, ?)", (period, time.time(), revision))
+
+    def unchecked_invoices(self, period, months):
+        """
+        取得某期 (months 為該期的兩個 YYYY-MM) 中還沒對過獎的發票。
+        這一期上次對完獎之後發票都沒有新增或變動時直接回傳空列表，不必再掃描發票
+        """
+        sql = (
+            "SELECT l.date, l.user_id, l.invoice_number FROM ledger l "
+            "WHERE l.month IN (?, ?) AND length(l.invoice_number) = 8 AND l.user_id != '' "
+            "AND NOT EXISTS (SELECT 1 FROM prize_checked c WHERE c.user_id = l.user_id "
+            "AND c.invoice_number = l.invoice_number AND c.period = ?) ORDER BY l.row"
+        )
+        with self._lock, self.conn:
+            revision = self._revision()
+            checked = self.conn.execute("SELECT revision FROM prize_periods WHERE period = ?", (period,)).fetchone()
+            if checked and checked[0] == revision:
+                return []
+            rows = self.conn.execute(sql, (*months, period)).fetchall()
+            if rows:
+                # 等 record_prize_results 寫入結果後才算對完；記下查詢當下的版本，期間新增的發票下次仍會查到
+                self._checked_revision[period] = revision
+            else:
+                self._mark_period_checked(period, revision)
+            return rows
+
+    def record_prize_results(self, period, results):
+        """
+        記錄對獎結果 results: [(user_id, invoice_number, date, prize 或 None), ...]
+        """
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO prize_checked (user_id, invoice_number, period, date, prize) VALUES (?, ?, ?, ?, ?)",
+                [(u, inv, period, d, prize) for u, inv, d, prize in results]
+            )
+            revision = self._checked_revision.pop(period, None)
+            if revision is not None:
+                self._mark_period_checked(period, revision)
+
+    def pending_notifications(self):
+        """
+        已中獎但還沒通知成功的發票 (包含上次推播失敗的)
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT user_id, invoice_number, period, date, prize FROM prize_checked "
+                "WHERE prize IS NOT NULL AND notified = 0"
+            ).fetchall()
+
+    def mark_notified(self, rows):
+        """
+        rows: pending_notifications() 回傳的紀錄
+        """
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE prize_checked SET notified = 1 WHERE user_id = ? AND invoice_number = ? AND period = ?",
+                [(r['user_id'], r['invoice_number'], r['period']) for r in rows]
+            )
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self.conn:
+            self._set_meta(key, str(value))
+
+    def mark_dirty(self):
+        """
+        寫入後無法確定列號時呼叫，下次讀取會強制全量對帳
+        """
+        self.set_meta("dirty", "1")
+
+    def needs_full_sync(self, interval):
+        if self.get_meta("dirty", "0") == "1":
+            return True
+        last = float(self.get_meta("last_full_sync", "0"))
+        return time.time() - last > interval
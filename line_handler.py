@@ -1,40 +1,174 @@
 from datetime import datetime
 import re
+from urllib.parse import urlencode, parse_qsl
 from prize_manager import prize_manager
-from linebot.models import (
-    FlexSendMessage, BubbleContainer, BoxComponent, 
-    TextComponent, ButtonComponent, SeparatorComponent, 
-    MessageAction
-)
+import flex_templates as flex
+from config import DETAIL_ROWS_PER_BUBBLE
+from metrics import timed
+
+# 本地快速解析 (不需呼叫 Gemini) 用的設定
+CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '兩': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+CN_UNITS = {'十': 10, '百': 100, '千': 1000, '萬': 10000}
+AMOUNT_RE = r'(?:NT\$|\$)?[\d.,零〇一二兩三四五六七八九十百千萬]+(?:元|塊錢|塊)?'
+# 半形逗號夾在數字之間時是千分位 (「1,250」)，不當成分隔符號
+ITEM_SEPARATORS = r'(?:[，、；;\n]|(?<!\d),|,(?!\d))+'
+MAX_CATEGORY_LEN = 6
+# 量詞/單位：「2杯」「1小時」是數量不是金額。
+# 「晚」「天」「套」「包」這類也常是類別開頭 (晚餐、套餐、包子) 的字不列入，避免「100 晚餐」被當成數量
+COUNTER_WORDS = ['小時', '分鐘', '公斤', '公里', '杯', '張', '個', '次', '份', '瓶', '顆', '罐', '趟', '堂', '隻']
+# 出現這些字眼代表是一句話 (或帶有日期)，交給 Gemini 判斷比較保險
+SENTENCE_MARKERS = ['今天', '昨天', '前天', '明天', '上週', '上個月', '花了', '總共', '一共', '了', '號', '?', '？']
+
+
+def parse_amount(token):
+    """
+    將金額字串轉為數字，支援阿拉伯數字與中文數字混用：
+    「150」「150元」「1,200」「一千二」「3千5」「兩百五」「一百零五」「1.5萬」
+    無法解析時回傳 None
+    """
+    token = re.sub(r'^(NT\$|\$)|(元|塊錢|塊)$', '', token).replace(',', '')
+    if not token:
+        return None
+    if re.fullmatch(r'\d+(\.\d+)?', token):
+        value = float(token)
+    else:
+        total = 0       # 已完成的「萬」段
+        section = 0     # 萬以下的累計
+        num = None      # 尚未乘上單位的數字
+        last_unit = None
+        after_zero = False
+        for part in re.findall(r'\d+(?:\.\d+)?|.', token):
+            if part[0].isdigit():
+                if num is not None:
+                    return None
+                num = float(part)
+            elif part in ('零', '〇'):
+                after_zero = True
+            elif part in CN_DIGITS:
+                if num is not None:
+                    return None
+                num = CN_DIGITS[part]
+            elif part in CN_UNITS:
+                unit = CN_UNITS[part]
+                if unit == 10000:
+                    # 「五十萬」「兩千萬」：萬以下已累計的部分整段乘上萬；單獨的「萬」才視為一萬
+                    if section or num is not None:
+                        total += (section + (num or 0)) * unit
+                    else:
+                        total += unit
+                    section = 0
+                else:
+                    section += (num if num is not None else 1) * unit
+                num = None
+                last_unit = unit
+                after_zero = False
+            else:
+                return None
+        if num is not None:
+            # 「一千二」「3千5」：尾數省略單位時代表下一位 (1200、3500)
+            if last_unit and not after_zero and num < 10:
+                num *= last_unit // 10
+            section += num
+        value = total + section
+    if value <= 0:
+        return None
+    return int(value) if value == int(value) else value
+
+
+def _tokenize(chunk):
+    """
+    將一段文字拆成 [('word', 文字) | ('amount', 金額) | ('quantity', 原字串), ...]；
+    「早餐100」「100元早餐」這類黏在一起的寫法也會拆開。
+    「2杯」「1小時」「3 個」這類數字加量詞的寫法標成 quantity，由呼叫端交給 Gemini
+    """
+    tokens = []
+    words = chunk.split()
+    for i, word in enumerate(words):
+        amount = parse_amount(word)
+        if amount is not None:
+            # 「3 個蘋果」：沒有幣別的數字後面接量詞，是數量不是金額
+            next_word = words[i + 1] if i + 1 < len(words) else ''
+            if next_word.startswith(tuple(COUNTER_WORDS)) and not re.search(r'^(NT\$|\$)|(元|塊錢|塊)$', word):
+                tokens.append(('quantity', word))
+                continue
+            tokens.append(('amount', amount))
+            continue
+        m = re.fullmatch(rf'(\D+?)({AMOUNT_RE})', word) or re.fullmatch(rf'({AMOUNT_RE})(\D+)', word)
+        if m:
+            left, right = m.groups()
+            left_amount, right_amount = parse_amount(left), parse_amount(right)
+            if right_amount is not None and left_amount is None:
+                tokens += [('word', left), ('amount', right_amount)]
+                continue
+            # 金額在前的黏寫只接受阿拉伯數字，避免把「三明治」拆成 3 + 明治
+            if left_amount is not None and right_amount is None and re.search(r'\d', left):
+                # 沒有 $ / 元 標示、後面只接一兩個字或量詞時，多半是數量 (「2杯」「1小時」)
+                has_currency = re.search(r'^(NT\$|\$)|(元|塊錢|塊)$', left)
+                if right.startswith(tuple(COUNTER_WORDS)) or (len(right) <= 2 and not has_currency):
+                    tokens.append(('quantity', word))
+                    continue
+                tokens += [('amount', left_amount), ('word', right)]
+                continue
+        tokens.append(('word', word))
+    return tokens
+
 
 class LineHandler:
     @staticmethod
     def parse_message(text):
         """
-        解析訊息，例如：
+        在本地解析簡單的記帳訊息，不需要呼叫 Gemini，例如：
         「早餐 100」-> category="早餐", amount=100
         「100 晚餐」-> category="晚餐", amount=100
         「午餐 150 今天很熱」-> category="午餐", amount=150, note="今天很熱"
+        「晚餐 一千二」「計程車 3千5」-> amount=1200 / 3500
+        「早餐 50 午餐 120」「早餐 50，午餐 120」-> 兩筆紀錄
+        回傳紀錄列表；只要有任何一段沒把握解析就回傳 None，交給 Gemini 處理
         """
-        # 尋找數字 (金額)
-        amount_match = re.search(r'\d+', text)
-        if not amount_match:
-            return None
-        
-        amount = int(amount_match.group())
-        
-        # 移除數字後的剩餘文字作為類別與備註
-        parts = text.replace(str(amount), '').split()
-        category = parts[0] if len(parts) > 0 else "未分類"
-        note = " ".join(parts[1:]) if len(parts) > 1 else ""
-        
-        return {
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "category": category,
-            "amount": amount,
-            "note": note
-        }
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        records = []
+        for chunk in re.split(ITEM_SEPARATORS, text.strip()):
+            if not chunk.strip():
+                continue
+            tokens = _tokenize(chunk)
+            kinds = [k for k, _ in tokens]
+            if 'quantity' in kinds:
+                return None
+            amount_count = kinds.count('amount')
+            if amount_count == 0:
+                return None
+
+            if amount_count == 1:
+                # 單筆：「類別 金額 [備註]」或「金額 類別 [備註]」
+                idx = kinds.index('amount')
+                words = [v for k, v in tokens if k == 'word']
+                if not words or idx > 1 or (idx == 1 and kinds[0] != 'word'):
+                    return None
+                pairs = [(words[0], tokens[idx][1], " ".join(words[1:]))]
+            else:
+                # 多筆：必須是「類別 金額 類別 金額...」或「金額 類別 金額 類別...」交錯排列
+                if len(tokens) % 2 or any(kinds[i] == kinds[i + 1] for i in range(0, len(tokens), 2)):
+                    return None
+                pairs = []
+                for i in range(0, len(tokens), 2):
+                    (k1, v1), (_, v2) = tokens[i], tokens[i + 1]
+                    pairs.append((v1, v2, "") if k1 == 'word' else (v2, v1, ""))
+
+            for category, amount, note in pairs:
+                if len(category) > MAX_CATEGORY_LEN or any(m in category for m in SENTENCE_MARKERS):
+                    return None
+                if any(m in note for m in SENTENCE_MARKERS if m not in ('今天', '了')):
+                    return None
+                records.append({
+                    "date": now,
+                    "category": category,
+                    "amount": amount,
+                    "note": note
+                })
+        return records or None
+
     @staticmethod
+    @timed('flex_render')
     def get_batch_summary_flex(records):
         """
         生成批次記帳成功的彙總卡片
@@ -43,57 +177,18 @@ class LineHandler:
         total = sum(float(r.get('amount', 0)) for r in records)
         
         # 建立前 5 筆預覽
-        preview_rows = []
-        for r in records[:5]:
-            preview_rows.append(
-                BoxComponent(
-                    layout='horizontal',
-                    contents=[
-                        TextComponent(text=f"• {r.get('category')}", size='xs', color='#888888', flex=1),
-                        TextComponent(text=f"{r.get('amount')}元", size='xs', color='#555555', align='end', flex=2)
-                    ]
-                )
-            )
+        preview_rows = [
+            flex.BATCH_PREVIEW_ROW.render(category=f"• {r.get('category')}", amount=f"{r.get('amount')}元")
+            for r in records[:5]
+        ]
         if count > 5:
-            preview_rows.append(TextComponent(text=f"...以及其他 {count-5} 筆交易", size='xxs', color='#AAAAAA', align='center', margin='sm'))
+            preview_rows.append(flex.BATCH_MORE.render(text=f"...以及其他 {count-5} 筆交易"))
 
-        bubble = BubbleContainer(
-            direction='ltr',
-            header=BoxComponent(
-                layout='vertical',
-                background_color='#FFB2B2',
-                padding_all='20px',
-                contents=[
-                    TextComponent(text='📝 批次記帳成功 📝', weight='bold', size='md', color='#ffffff', align='center')
-                ]
-            ),
-            body=BoxComponent(
-                layout='vertical',
-                padding_all='20px',
-                contents=[
-                    TextComponent(text='總計匯入筆數', size='xs', color='#AAAAAA', align='center'),
-                    TextComponent(text=f'{count} 筆', weight='bold', size='xl', color='#FF6B6B', align='center', margin='xs'),
-                    TextComponent(text=f'總金額：NT$ {total}', size='sm', color='#FF8888', align='center', margin='xs'),
-                    SeparatorComponent(margin='xl', color='#FFEEEE'),
-                    TextComponent(text='資料預覽：', size='xs', weight='bold', margin='md', color='#888888'),
-                    BoxComponent(
-                        layout='vertical',
-                        margin='sm',
-                        spacing='xs',
-                        contents=preview_rows
-                    )
-                ]
-            ),
-            footer=BoxComponent(
-                layout='vertical',
-                contents=[
-                    TextComponent(text='已成功同步至 Google Sheets！✨', size='xxs', color='#FFB2B2', align='center', margin='md')
-                ]
-            )
-        )
-        return FlexSendMessage(alt_text=f"📝 批次記帳成功！共 {count} 筆", contents=bubble)
+        bubble = flex.BATCH_SUMMARY.render(count=f'{count} 筆', total=f'總金額：NT$ {total}', rows=preview_rows)
+        return flex.RawFlexMessage(alt_text=f"📝 批次記帳成功！共 {count} 筆", contents=bubble)
 
     @staticmethod
+    @timed('flex_render')
     def get_summary_flex(summary_data):
         """
         生成統計報表的 Flex Message
@@ -105,170 +200,75 @@ class LineHandler:
         cat_details = summary_data.get('category_details', {})
 
         # 建立類別按鈕列表
-        cat_rows = []
-        for cat, amt in cat_details.items():
-            cat_rows.append(
-                ButtonComponent(
-                    action=MessageAction(label=f"{cat}: {amt} 元", text=f"類別細目:{cat}"),
-                    style='secondary',
-                    color='#F0F0F0',
-                    margin='xs',
-                    height='sm'
-                )
-            )
-
-        bubble = BubbleContainer(
-            direction='ltr',
-            header=BoxComponent(
-                layout='vertical',
-                background_color='#1DB446',
-                contents=[
-                    TextComponent(text=title, weight='bold', size='lg', color='#ffffff', align='center')
-                ]
-            ),
-            body=BoxComponent(
-                layout='vertical',
-                contents=[
-                    TextComponent(text='總支出金額', size='xs', color='#AAAAAA', align='center'),
-                    TextComponent(text=f'NT$ {total}', weight='bold', size='xxl', margin='md', align='center', color='#1DB446'),
-                    
-                    # 預算進度條
-                    BoxComponent(
-                        layout='vertical',
-                        margin='lg',
-                        contents=[
-                            BoxComponent(
-                                layout='horizontal',
-                                contents=[
-                                    TextComponent(text='預算進度', size='xs', color='#888888', flex=1),
-                                    TextComponent(text=f'{int((total/summary_data.get("budget", 1))*100)}%', size='xs', color='#888888', align='end', flex=1)
-                                ]
-                            ),
-                            BoxComponent(
-                                layout='vertical',
-                                margin='sm',
-                                background_color='#EEEEEE',
-                                height='6px',
-                                border_radius='3px',
-                                contents=[
-                                    BoxComponent(
-                                        layout='vertical',
-                                        width=f'{min(100, int((total/summary_data.get("budget", 1))*100))}%',
-                                        background_color='#1DB446' if total <= summary_data.get('budget', 0) else '#FF6B6B',
-                                        height='6px',
-                                        border_radius='3px',
-                                        contents=[]
-                                    )
-                                ]
-                            ),
-                            TextComponent(text=f'剩餘：NT$ {summary_data.get("remaining")}', size='xxs', color='#AAAAAA', margin='xs', align='end')
-                        ]
-                    ),
+        cat_rows = [
+            flex.CATEGORY_BUTTON.render(label=f"{cat}: {amt} 元", message=f"類別細目:{cat}")
+            for cat, amt in cat_details.items()
+        ]
 
-                    SeparatorComponent(margin='xl'),
-                    TextComponent(text='類別統計 (點擊看明細)', size='sm', weight='bold', margin='lg', color='#555555'),
-                    BoxComponent(
-                        layout='vertical',
-                        margin='md',
-                        spacing='xs',
-                        contents=cat_rows
-                    ),
-                    SeparatorComponent(margin='xl'),
-                    BoxComponent(
-                        layout='horizontal',
-                        margin='md',
-                        contents=[
-                            TextComponent(text='總計筆數', size='xs', color='#AAAAAA', flex=1),
-                            TextComponent(text=f'{count} 筆', size='xs', color='#AAAAAA', align='end', flex=4)
-                        ]
-                    )
-                ]
-            ),
-            footer=BoxComponent(
-                layout='vertical',
-                contents=[
-                    SeparatorComponent(margin='md'),
-                    ButtonComponent(
-                        action=MessageAction(
-                            label='查看詳細明細' if '家庭' not in title else '查看全家明細', 
-                            text='詳細報表' if '家庭' not in title else '家庭明細'
-                        ),
-                        style='link',
-                        color='#1DB446',
-                        height='sm'
-                    )
-                ]
-            )
+        percent = int((total/summary_data.get("budget", 1))*100)
+        is_family = '家庭' in title
+        bubble = flex.SUMMARY.render(
+            title=title,
+            total=f'NT$ {total}',
+            percent=f'{percent}%',
+            bar_width=f'{min(100, percent)}%',
+            bar_color='#1DB446' if total <= summary_data.get('budget', 0) else '#FF6B6B',
+            remaining=f'剩餘：NT$ {summary_data.get("remaining")}',
+            categories=cat_rows,
+            count=f'{count} 筆',
+            detail_label='查看全家明細' if is_family else '查看詳細明細',
+            detail_message='家庭明細' if is_family else '詳細報表'
         )
-        return FlexSendMessage(alt_text=f"{month} 消費月報", contents=bubble)
+        return flex.RawFlexMessage(alt_text=f"{month} 消費月報", contents=bubble)
 
     @staticmethod
-    def get_detailed_list_flex(summary_data, filter_category=None):
+    def detail_postback(scope, month, cursor, start, category=None):
         """
-        生成交易清單，支援選用特定類別篩選
+        「下一頁」按鈕的 postback data。scope 為 me / family，不放入使用者 ID，處理時一律以事件來源為準
         """
-        title = summary_data.get('title', '消費細目')
-        items = summary_data.get('items', [])
-        
-        # 篩選類別
-        if filter_category:
-            items = [it for it in items if it.get('category') == filter_category]
-            display_title = f"{filter_category} 支出細目"
-        else:
-            display_title = title
+        data = {'action': 'detail', 'scope': scope, 'month': month, 'cursor': cursor, 'start': start}
+        if category:
+            data['category'] = category
+        return urlencode(data)
 
-        # 只顯示最近的 20 筆
-        display_items = items[-20:]
-        
-        item_rows = []
-        for it in display_items:
-            # 格式化日期只取日
-            short_date = it.get('date', '').split(' ')[0].split('-')[-1] + "日"
-            item_rows.append(
-                BoxComponent(
-                    layout='horizontal',
-                    margin='sm',
-                    contents=[
-                        TextComponent(text=short_date, size='xs', color='#AAAAAA', flex=1),
-                        TextComponent(text=it.get('category'), size='sm', color='#555555', flex=2),
-                        TextComponent(text=f"{it.get('amount')}元", size='sm', color='#111111', align='end', flex=2)
-                    ]
-                )
-            )
+    @staticmethod
+    def parse_postback(data):
+        return dict(parse_qsl(data or ''))
 
-        bubble = BubbleContainer(
-            direction='ltr',
-            header=BoxComponent(
-                layout='vertical',
-                background_color='#1DB446',
-                contents=[
-                    TextComponent(text=f"📋 {display_title}", weight='bold', size='md', color='#ffffff', align='center')
-                ]
-            ),
-            body=BoxComponent(
-                layout='vertical',
-                contents=[
-                    BoxComponent(
-                        layout='horizontal',
-                        contents=[
-                            TextComponent(text='編號', size='xs', color='#AAAAAA', flex=1),
-                            TextComponent(text='項目', size='xs', color='#AAAAAA', flex=2),
-                            TextComponent(text='金額', size='xs', color='#AAAAAA', align='end', flex=2)
-                        ]
-                    ),
-                    SeparatorComponent(margin='sm'),
-                    BoxComponent(
-                        layout='vertical',
-                        margin='md',
-                        spacing='sm',
-                        contents=item_rows
-                    )
-                ]
-            )
+    @staticmethod
+    def _detail_row(it):
+        # 格式化日期只取日
+        return flex.DETAIL_ROW.render(
+            day=str(it.get('date', '')).split(' ')[0].split('-')[-1] + "日",
+            category=it.get('category'),
+            amount=f"{it.get('amount')}元"
         )
-        return FlexSendMessage(alt_text="詳細交易清單", contents=bubble)
 
     @staticmethod
+    @timed('flex_render')
+    def get_detail_page_flex(title, page, scope='me', start=1, category=None):
+        """
+        分頁明細：每 DETAIL_ROWS_PER_BUBBLE 筆一張卡片組成 carousel，還有資料時最後一張附上「下一頁」
+        page: gsheet.get_items_page 的回傳值；start 為這一頁第一筆的序號
+        """
+        items = page.get('items', [])
+        bubbles = []
+        for offset in range(0, len(items), DETAIL_ROWS_PER_BUBBLE):
+            chunk = items[offset:offset + DETAIL_ROWS_PER_BUBBLE]
+            first = start + offset
+            bubbles.append(flex.DETAIL_LIST.render(
+                title=f"📋 {title} ({first}-{first + len(chunk) - 1})",
+                rows=[LineHandler._detail_row(it) for it in chunk]
+            ))
+        if page.get('next_cursor') and bubbles:
+            bubbles[-1]['footer'] = flex.DETAIL_NEXT.render(
+                data=LineHandler.detail_postback(scope, page['month'], page['next_cursor'], start + len(items), category),
+                display_text=f"下一頁 (第 {start + len(items)} 筆起)"
+            )
+        return flex.RawFlexMessage(alt_text=f"詳細交易清單 ({start}-{start + len(items) - 1})", contents=flex.CAROUSEL.render(bubbles=bubbles))
+
+    @staticmethod
+    @timed('flex_render')
     def get_flex_message(record):
         """
         將記帳紀錄轉換為超可愛的 Flex Message
@@ -297,89 +297,11 @@ class LineHandler:
         elif invoice_number:
              prize_text = f"🎫 發票辨識：{invoice_number} (號碼異常)"
 
-        bubble_contents = [
-            # 大大圓圓的金額顯示
-            BoxComponent(
-                layout='vertical',
-                background_color='#FFF0F0',
-                border_radius='20px',
-                padding_all='15px',
-                contents=[
-                    TextComponent(text=f'NT$ {amount}', weight='bold', size='xxl', color='#FF6B6B', align='center'),
-                    TextComponent(text=comment, size='xs', color='#FFAAAA', align='center', margin='sm')
-                ]
-            )
-        ]
-
+        # 大大圓圓的金額顯示
+        bubble_contents = [flex.RECORD_AMOUNT.render(amount=f'NT$ {amount}', comment=comment)]
         if prize_text:
-            bubble_contents.append(
-                BoxComponent(
-                    layout='vertical',
-                    margin='md',
-                    background_color='#FDFDFD',
-                    padding_all='10px',
-                    border_width='1px',
-                    border_color='#EEEEEE',
-                    border_radius='md',
-                    contents=[
-                        TextComponent(text=prize_text, size='xs', color=prize_color, wrap=True, align='center')
-                    ]
-                )
-            )
+            bubble_contents.append(flex.RECORD_PRIZE.render(text=prize_text, color=prize_color))
+        bubble_contents.append(flex.RECORD_DETAILS.render(category=category, note=note if note else '無', date=date))
 
-        bubble_contents.append(
-            BoxComponent(
-                layout='vertical',
-                margin='xl',
-                spacing='md',
-                contents=[
-                    BoxComponent(
-                        layout='horizontal',
-                        contents=[
-                            TextComponent(text='🐾 類別', size='sm', color='#888888', flex=1),
-                            TextComponent(text=category, size='sm', color='#555555', align='end', flex=4, weight='bold')
-                        ]
-                    ),
-                    BoxComponent(
-                        layout='horizontal',
-                        contents=[
-                            TextComponent(text='📝 備註', size='sm', color='#888888', flex=1),
-                            TextComponent(text=note if note else '無', size='sm', color='#555555', align='end', flex=4)
-                        ]
-                    ),
-                    SeparatorComponent(margin='md', color='#FFEEEE'),
-                    BoxComponent(
-                        layout='horizontal',
-                        margin='md',
-                        contents=[
-                            TextComponent(text='⏰ 時間', size='xs', color='#AAAAAA', flex=1),
-                            TextComponent(text=date, size='xs', color='#AAAAAA', align='end', flex=4)
-                        ]
-                    )
-                ]
-            )
-        )
-
-        bubble = BubbleContainer(
-            direction='ltr',
-            header=BoxComponent(
-                layout='vertical',
-                background_color='#FFB2B2',
-                padding_all='20px',
-                contents=[
-                    TextComponent(text='🌸 記帳漂亮成功 🌸', weight='bold', size='md', color='#ffffff', align='center')
-                ]
-            ),
-            body=BoxComponent(
-                layout='vertical',
-                padding_all='20px',
-                contents=bubble_contents
-            ),
-            footer=BoxComponent(
-                layout='vertical',
-                contents=[
-                    TextComponent(text='繼續保持唷！加油！🍰', size='xs', color='#FFB2B2', align='center', margin='md')
-                ]
-            )
-        )
-        return FlexSendMessage(alt_text=f"🌸 記帳成功囉！花了 {amount} 元", contents=bubble)
+        bubble = flex.RECORD.render(contents=bubble_contents)
+        return flex.RawFlexMessage(alt_text=f"🌸 記帳成功囉！花了 {amount} 元", contents=bubble)
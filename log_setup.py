@@ -0,0 +1,114 @@
+"""
+非同步的結構化 (JSON) 紀錄：
+- 所有 logger 只把紀錄丟進佇列 (QueueHandler)，由背景的 QueueListener 負責格式化與寫出，請求不會卡在 I/O
+- 每個 webhook 請求有一個 request ID (contextvars)，背景執行緒也會帶著，方便串起同一個請求的紀錄
+- 使用者 ID 一律以 mask_user 遮蔽後才寫入
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+
+request_id = contextvars.ContextVar('request_id', default='-')
+
+
+def new_request_id():
+    rid = uuid.uuid4().hex[:12]
+    request_id.set(rid)
+    return rid
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """
+    將目前的 contextvars (包含 request ID) 帶進執行緒池。每個工作各自複製一份，可以同時執行
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def mask_user(user_id):
+    """
+    紀錄中不寫出完整的 LINE user ID，只留可比對的短雜湊
+    """
+    if not user_id:
+        return '-'
+    return 'u:' + hashlib.sha256(str(user_id).encode()).hexdigest()[:10]
+
+
+def sampled(rate):
+    return rate >= 1 or random.random() < rate
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    在產生紀錄的執行緒中 (進佇列之前) 記下 request ID
+    """
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # LogRecord 內建的欄位，其餘透過 extra= 傳入的欄位會一併輸出
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'request_id', 'asctime'}
+
+    def format(self, record):
+        data = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED:
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    內建的 QueueHandler.prepare() 會在呼叫端的執行緒格式化訊息與 traceback，並清掉 exc_info。
+    這裡把紀錄原樣放進佇列，格式化全部交給 listener 的執行緒
+    """
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level='INFO', json_format=True, stream=None):
+    """
+    以 QueueHandler / QueueListener 取代 root logger 的 handler (重複呼叫不會重複設定)
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if json_format:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import tempfile
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaBuffer:
+    """
+    下載 LINE 多媒體內容用的緩衝區：
+    - 小檔案 (收據照片、語音) 直接留在記憶體，不經過暫存檔
+    - 超過 spool_bytes 才寫到暫存檔 (大型 PDF 帳單)
+    - 超過 max_bytes 立即中止，避免單一上傳吃光記憶體或磁碟
+    寫入時同步計算 sha256，供解析快取使用
+    """
+    def __init__(self, spool_bytes, max_bytes, suffix=""):
+        self.spool_bytes = spool_bytes
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.size = 0
+        self.path = None
+        self._chunks = []
+        self._file = None
+        self._sha = hashlib.sha256()
+
+    @classmethod
+    def from_chunks(cls, chunks, spool_bytes, max_bytes, suffix=""):
+        buf = cls(spool_bytes, max_bytes, suffix)
+        try:
+            for chunk in chunks:
+                buf.write(chunk)
+            buf.finish()
+        except Exception:
+            buf.close()
+            raise
+        return buf
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise MediaTooLarge(f"media exceeds {self.max_bytes} bytes")
+        self._sha.update(chunk)
+        if self._file is None and self.size > self.spool_bytes:
+            self._file = tempfile.NamedTemporaryFile(delete=False, suffix=self.suffix)
+            self.path = self._file.name
+            for c in self._chunks:
+                self._file.write(c)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    @property
+    def digest(self):
+        return self._sha.hexdigest()
+
+    def getvalue(self):
+        """
+        取得完整內容 (僅限留在記憶體時)。合併後只保留一份，重複呼叫不會再複製
+        """
+        if not self.in_memory:
+            with open(self.path, "rb") as f:
+                return f.read()
+        if len(self._chunks) != 1:
+            self._chunks = [b"".join(self._chunks)]
+        return self._chunks[0]
+
+    def close(self):
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,131 @@
+"""
+輕量的 Prometheus 指標 (不額外安裝 prometheus_client)：Counter、Histogram 與文字格式輸出。
+指標存在各自的程序內；gunicorn 開多個 worker 時 /metrics 只會回報處理該次請求的 worker
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [各 bucket 計數..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(n, "") for n in self.labelnames))
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels_text(self.labelnames + ('le',), key + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames + ('le',), key + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+HTTP_REQUESTS = Counter('bookeep_http_requests_total', 'HTTP requests handled', ['path', 'status'])
+WEBHOOK_EVENTS = Counter('bookeep_webhook_events_total', 'LINE webhook events received', ['type'])
+ERRORS = Counter('bookeep_errors_total', 'Errors by stage', ['stage'])
+STAGE_SECONDS = Histogram('bookeep_stage_seconds', 'Latency of each processing stage', ['stage'])
+GEMINI_TOKENS = Counter('bookeep_gemini_tokens_total', 'Gemini tokens used', ['kind'])
+SHEETS_CALLS = Counter('bookeep_sheets_calls_total', 'Google Sheets API calls', ['stage'])
+SHEETS_RETRIES = Counter('bookeep_sheets_retries_total', 'Google Sheets API calls retried after quota or server errors', ['status'])
+DUPLICATE_EVENTS = Counter('bookeep_webhook_duplicates_total', 'Webhook events skipped because they were already processed or in flight', ['redelivery'])
+
+ALL_METRICS = [HTTP_REQUESTS, WEBHOOK_EVENTS, ERRORS, STAGE_SECONDS, GEMINI_TOKENS, SHEETS_CALLS, SHEETS_RETRIES, DUPLICATE_EVENTS]
+
+
+@contextmanager
+def span(stage):
+    """
+    量測一個處理階段的耗時；發生例外時同時累加該階段的錯誤數
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed(stage):
+    """
+    span 的裝飾器版本
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render():
+    lines = []
+    for metric in ALL_METRICS:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,101 @@
+import threading
+import time
+import random
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from log_setup import mask_user, submit_with_context
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    簡單的 token bucket：每秒補充 rate 個 token，最多累積 capacity 個
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NotificationDispatcher:
+    """
+    推播通知的派送器：
+    - 同一位使用者的多筆通知合併成一則訊息
+    - 以有限的執行緒同時推播，並用 token bucket 限制每秒請求數
+    - 失敗時以指數退避重試 (4xx 錯誤除了 429 之外不重試)
+    """
+    def __init__(self, send, build_message, max_workers=4, rate=20, max_retries=3, backoff=1.0):
+        self.send = send                    # send(user_id, message)
+        self.build_message = build_message  # build_message(user_id, items) -> message
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    @staticmethod
+    def _retryable(error):
+        status = getattr(error, 'status_code', None)
+        return status is None or status == 429 or status >= 500
+
+    def _deliver(self, user_id, items):
+        """
+        回傳 (是否成功, 重試次數)
+        """
+        message = self.build_message(user_id, items)
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                self.send(user_id, message)
+                return True, attempt
+            except Exception as e:
+                if not self._retryable(e) or attempt == self.max_retries:
+                    logger.error(f"❌ Failed to notify user {mask_user(user_id)}: {e}")
+                    return False, attempt
+                time.sleep(random.uniform(0.5, 1.0) * self.backoff * (2 ** attempt))
+
+    def dispatch(self, notifications, key=lambda n: n['user_id']):
+        """
+        派送通知，回傳 (成功送達的通知列表, 統計)
+        """
+        groups = OrderedDict()
+        for n in notifications:
+            groups.setdefault(key(n), []).append(n)
+        if not groups:
+            return [], {'users': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'seconds': 0.0}
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as pool:
+            futures = [submit_with_context(pool, self._deliver, *g) for g in groups.items()]
+            outcomes = [f.result() for f in futures]
+
+        delivered = []
+        stats = {'users': len(groups), 'sent': 0, 'failed': 0, 'retries': 0}
+        for (user_id, items), (ok, retries) in zip(groups.items(), outcomes):
+            stats['retries'] += retries
+            if ok:
+                stats['sent'] += 1
+                delivered.extend(items)
+            else:
+                stats['failed'] += 1
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        logger.info(
+            f"📬 Notification delivery: {stats['sent']}/{stats['users']} users sent, "
+            f"{stats['failed']} failed, {stats['retries']} retries in {stats['seconds']}s"
+        )
+        return delivered, stats
@@ -0,0 +1,85 @@
+import sqlite3
+import threading
+import hashlib
+import json
+import time
+import unicodedata
+
+
+class ParseCache:
+    """
+    Gemini 解析結果的內容定址快取 (SQLite)。
+    以內容的雜湊加上 prompt 版本當 key，同一張收據、同一份帳單或同一段文字再傳一次時直接回傳結果。
+    超過 ttl 秒的項目視為過期；總大小超過 max_bytes 時依最近使用時間 (LRU) 淘汰
+    """
+    def __init__(self, db_path, max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS parse_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    size INTEGER,
+                    created REAL,
+                    last_used REAL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_parse_cache_last_used ON parse_cache (last_used)")
+
+    @staticmethod
+    def normalize_text(text):
+        """
+        文字正規化：全形轉半形、合併空白，讓「午餐　150」與「午餐 150」命中同一筆
+        """
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        parts 可以是 bytes 或 str，依序加入雜湊
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            h.update(part)
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT value, created FROM parse_cache WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM parse_cache WHERE key = ?", (key,))
+                return None
+            self.conn.execute("UPDATE parse_cache SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM parse_cache WHERE created < ?", (now - self.ttl,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM parse_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 從最久沒用到的開始刪，直到總大小回到上限以下
+        for key, size in self.conn.execute("SELECT key, size FROM parse_cache ORDER BY last_used").fetchall():
+            self.conn.execute("DELETE FROM parse_cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
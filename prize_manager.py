@@ -1,44 +1,200 @@
 import requests
-from bs4 import BeautifulSoup
 import re
-from datetime import datetime
+import json
+import sqlite3
+import threading
+import logging
+from datetime import datetime, date
+from collections import defaultdict
+from config import PRIZE_DB_PATH, PRIZE_FETCH_TIMEOUT
+from lazy import Lazy
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# 頭獎號碼末 N 碼相同的獎項
+SUFFIX_PRIZES = {
+    8: "💰 20萬元 (頭獎)！",
+    7: "💰 4萬元 (二獎)！",
+    6: "💰 1萬元 (三獎)！",
+    5: "💰 4千元 (四獎)！",
+    4: "💰 1千元 (五獎)！",
+    3: "🧧 200元 (六獎)！",
+}
+NO_PRIZE_MSG = "再接再厲，下一張就會中！💪"
+NOT_DRAWN_MSG = "這期 ({period}) 尚未開獎或已過期喔！"
 
 class PrizeManager:
     """
     負責從「財政部稅務入口網」抓取中獎號碼並進行對獎
     """
-    def __init__(self):
+    def __init__(self, db_path=PRIZE_DB_PATH):
         self.url = "https://invoice.etax.nat.gov.tw/"
         self.winning_numbers = {} # { 'period': { 'special': '...', 'grand': '...', 'first': [...] } }
+        self._index = {} # { 'period': { 'exact': {號碼: 獎項}, 'suffix3': {末三碼: [頭獎號碼...]} } }
+        self._lock = threading.Lock()
+        self._data_version = None
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS winning_numbers (
+                    period TEXT PRIMARY KEY,   -- 例如 "113年01-02月"
+                    special TEXT,
+                    grand TEXT,
+                    first TEXT,                -- JSON 列表
+                    claim_deadline TEXT        -- YYYY-MM-DD，過了就不再保留
+                )
+            """)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS fetch_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._load()
+
+    @staticmethod
+    def normalize_period(text):
+        """
+        將網頁上的期別文字 (例如 "113年 01 ~ 02 月") 統一成 get_period_from_date 的格式 "113年01-02月"
+        """
+        nums = re.findall(r'\d+', text)
+        if len(nums) < 3:
+            return text
+        return f"{int(nums[0])}年{int(nums[1]):02d}-{int(nums[2]):02d}月"
 
-    def fetch_winning_numbers(self):
+    @staticmethod
+    def claim_deadline(period):
         """
-        爬取官方網頁獲取最新兩期的中獎號碼
+        兌獎期限：開獎 (期末次月 25 日) 後，自次月 6 日起算三個月
         """
+        nums = re.findall(r'\d+', period)
+        year, end_month = int(nums[0]) + 1911, int(nums[2])
+        month = end_month + 5
+        return date(year + (month - 1) // 12, (month - 1) % 12 + 1, 5)
+
+    @staticmethod
+    def latest_drawn_period(today=None):
+        """
+        今天為止最近一次已開獎的期別 (單數月 25 日開出前兩個月)
+        """
+        today = today or date.today()
+        year, month = today.year, today.month
+        if month % 2 == 0 or today.day < 25:
+            month -= 1 if month % 2 == 0 else 2
+            if month < 1:
+                year, month = year - 1, month + 12
+        start = month - 2
+        if start < 1:
+            year, start = year - 1, start + 12
+        return f"{year - 1911}年{start:02d}-{start + 1:02d}月"
+
+    @staticmethod
+    def months_of_period(period):
+        """
+        "113年01-02月" -> ["2024-01", "2024-02"]
+        """
+        nums = re.findall(r'\d+', period)
+        year = int(nums[0]) + 1911
+        return [f"{year}-{int(nums[1]):02d}", f"{year}-{int(nums[2]):02d}"]
+
+    def _load(self):
+        """
+        從本地資料庫載入 (其他程序更新過時也會重新載入)，刪除已過兌獎期限的期別
+        """
+        with self._lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return
+            with self.conn:
+                self.conn.execute("DELETE FROM winning_numbers WHERE claim_deadline < ?", (date.today().isoformat(),))
+            rows = self.conn.execute("SELECT period, special, grand, first FROM winning_numbers").fetchall()
+            self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        # 新的期別排在前面
+        self.winning_numbers = {
+            period: {'special': special, 'grand': grand, 'first': json.loads(first)}
+            for period, special, grand, first in sorted(rows, key=lambda r: r[0], reverse=True)
+        }
+        self._index = {}
+
+    def save_period(self, period, data):
+        period = self.normalize_period(period)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO winning_numbers VALUES (?, ?, ?, ?, ?)",
+                (period, data['special'], data['grand'], json.dumps(data['first']),
+                 self.claim_deadline(period).isoformat())
+            )
+        # 自己寫入不會改變 data_version，強制重新載入
+        self._data_version = None
+        self._load()
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM fetch_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO fetch_meta VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def parse_page(html):
+        """
+        解析官方網頁，回傳 { 'period': { 'special', 'grand', 'first' } }
+        """
+        # 只有抓取開獎號碼時才需要 BeautifulSoup
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # 定義開獎區塊
+        # 官方頁面通常有「本期」與「上期」
+        periods = soup.find_all('h2', class_='etw-period')
+        tables = soup.find_all('table', class_='etw-table-bg')
+        
+        result = {}
+        for i in range(min(len(periods), len(tables))):
+            period_text = periods[i].get_text(strip=True) # 例如 "112年11-12月"
+            
+            rows = tables[i].find_all('tr')
+            result[PrizeManager.normalize_period(period_text)] = {
+                'special': rows[1].find('span', class_='etw-color-red').get_text(strip=True), # 特別獎
+                'grand': rows[2].find('span', class_='etw-color-red').get_text(strip=True),   # 特獎
+                'first': [n.strip() for n in rows[3].get_text().split('\n') if len(n.strip()) == 8] # 頭獎 (多組)
+            }
+        return result
+
+    def fetch_winning_numbers(self, force=False):
+        """
+        爬取官方網頁獲取最新的中獎號碼並存入本地資料庫。
+        - 最近一期已在資料庫中時直接略過 (除非 force)
+        - 以 ETag / Last-Modified 做條件式請求，網頁沒變時伺服器回 304
+        - 設定逾時，避免卡住排程
+        """
+        if not force and self.latest_drawn_period() in self.winning_numbers:
+            return True
+
         try:
-            response = requests.get(self.url)
+            headers = {}
+            etag = self._get_meta('etag')
+            last_modified = self._get_meta('last_modified')
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+            with span('prize_fetch'):
+                response = requests.get(self.url, headers=headers, timeout=PRIZE_FETCH_TIMEOUT)
+            if response.status_code == 304:
+                return True
+            response.raise_for_status()
             response.encoding = 'utf-8'
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 定義開獎區塊
-            # 官方頁面通常有「本期」與「上期」
-            periods = soup.find_all('h2', class_='etw-period')
-            tables = soup.find_all('table', class_='etw-table-bg')
-            
-            for i in range(min(len(periods), 2)):
-                period_text = periods[i].get_text(strip=True) # 例如 "112年11-12月"
-                # 轉為 YYYY-MM 格式供簡化比較 (這裡簡化處理)
-                
-                rows = tables[i].find_all('tr')
-                data = {
-                    'special': rows[1].find('span', class_='etw-color-red').get_text(strip=True), # 特別獎
-                    'grand': rows[2].find('span', class_='etw-color-red').get_text(strip=True),   # 特獎
-                    'first': [n.strip() for n in rows[3].get_text().split('\n') if len(n.strip()) == 8] # 頭獎 (多組)
-                }
-                self.winning_numbers[period_text] = data
+
+            for period, data in self.parse_page(response.text).items():
+                self.save_period(period, data)
+            if response.headers.get('ETag'):
+                self._set_meta('etag', response.headers['ETag'])
+            if response.headers.get('Last-Modified'):
+                self._set_meta('last_modified', response.headers['Last-Modified'])
             return True
         except Exception as e:
-            print(f"Fetch Prize Error: {e}")
+            logger.error(f"Fetch Prize Error: {e}")
             return False
 
     def get_period_from_date(self, date_str):
@@ -55,57 +211,110 @@ class PrizeManager:
         except:
             return None
 
-    def check_prize(self, invoice_number, invoice_date=None):
+    @staticmethod
+    def _compile_period(numbers):
         """
-        對獎邏輯
+        將一期的中獎號碼編成查表：完全相同的特別獎/特獎，以及以末三碼分組的頭獎號碼
         """
-        if not self.winning_numbers:
-            self.fetch_winning_numbers()
-        
-        target_period = self.get_period_from_date(invoice_date) if invoice_date else None
-        
-        # 找找看這個號碼在哪一期出現
-        found_in_any_period = False
-        
-        for period, numbers in self.winning_numbers.items():
-            # 如果有提供日期，我們先檢查這張發票是否屬於這一期
-            if target_period and target_period != period:
-                continue
-            
-            found_in_any_period = True
-            
-            # 1. 特別獎 (全中) 1000萬
-            if invoice_number == numbers['special']:
-                return True, f"🎉 1000萬 (特別獎)！太強了！\n({period})"
-            
-            # 2. 特獎 (全中) 200萬
-            if invoice_number == numbers['grand']:
-                return True, f"🎊 200萬 (特獎)！恭喜！\n({period})"
-            
-            # 3. 頭獎及其他獎 (從末位開始比)
-            for first in numbers['first']:
-                if invoice_number == first:
-                    return True, f"💰 20萬元 (頭獎)！\n({period})"
-                if invoice_number[-7:] == first[-7:]:
-                    return True, f"💰 4萬元 (二獎)！\n({period})"
-                if invoice_number[-6:] == first[-6:]:
-                    return True, f"💰 1萬元 (三獎)！\n({period})"
-                if invoice_number[-5:] == first[-5:]:
-                    return True, f"💰 4千元 (四獎)！\n({period})"
-                if invoice_number[-4:] == first[-4:]:
-                    return True, f"💰 1千元 (五獎)！\n({period})"
-                if invoice_number[-3:] == first[-3:]:
-                    return True, f"🧧 200元 (六獎)！\n({period})"
-        
+        exact = {}
+        if numbers.get('special'):
+            exact[numbers['special']] = "🎉 1000萬 (特別獎)！太強了！"
+        if numbers.get('grand'):
+            exact[numbers['grand']] = "🎊 200萬 (特獎)！恭喜！"
+        suffix3 = defaultdict(list)
+        for first in numbers.get('first', []):
+            suffix3[first[-3:]].append(first)
+        return {'exact': exact, 'suffix3': dict(suffix3)}
+
+    def _index_for(self, period):
+        index = self._index.get(period)
+        if index is None:
+            index = self._index[period] = self._compile_period(self.winning_numbers[period])
+        return index
+
+    def _match(self, invoice_number, period, index=None):
+        """
+        在單一期別中對獎，沒中回傳 None (index 為已取得的該期查表，批次對獎時每期只取一次)
+        """
+        index = index or self._index_for(period)
+        prize = index['exact'].get(invoice_number)
+        if prize:
+            return True, f"{prize}\n({period})"
+
+        # 末三碼相同才可能中頭獎~六獎，再往前比對相同的位數
+        best = 0
+        for first in index['suffix3'].get(invoice_number[-3:], ()):
+            n = 3
+            while n < 8 and invoice_number[-(n + 1):] == first[-(n + 1):]:
+                n += 1
+            best = max(best, n)
+        if best:
+            return True, f"{SUFFIX_PRIZES[best]}\n({period})"
+        return None
+
+    def _check(self, invoice_number, target_period):
+        if target_period:
+            periods = [target_period] if target_period in self.winning_numbers else []
+        else:
+            # 沒有日期時，找找看這個號碼在哪一期出現
+            periods = list(self.winning_numbers)
+
+        for period in periods:
+            hit = self._match(invoice_number, period)
+            if hit:
+                return hit
+
         if target_period and target_period not in self.winning_numbers:
             # 檢查是否太舊或太新 (尚未開獎)
             # 簡單邏輯：如果當前日期小於 target_period 對應的單數月25號，則尚未開獎
             # 這裡為了簡化，直接回傳尚未開獎或不在範圍內
-            return False, f"這期 ({target_period}) 尚未開獎或已過期喔！"
+            return False, NOT_DRAWN_MSG.format(period=target_period)
             
-        return False, "再接再厲，下一張就會中！💪"
+        return False, NO_PRIZE_MSG
+
+    def check_prize(self, invoice_number, invoice_date=None):
+        """
+        對獎邏輯 (只讀本地資料庫，不會在使用者請求中連線到官方網站)
+        """
+        self._load()
+        
+        target_period = self.get_period_from_date(invoice_date) if invoice_date else None
+        return self._check(invoice_number, target_period)
+
+    def check_prizes_batch(self, invoices):
+        """
+        批次對獎：invoices = [(invoice_number, invoice_date), ...]
+        依期別分組，每期只判斷一次是否已開獎並取得查表，回傳相同順序的 [(is_winner, msg), ...]
+        """
+        with span('prize_check'):
+            return self._check_batch(invoices)
+
+    def _check_batch(self, invoices):
+        self._load()
+
+        by_period = defaultdict(list)
+        for i, (_, invoice_date) in enumerate(invoices):
+            by_period[self.get_period_from_date(invoice_date) if invoice_date else None].append(i)
+
+        results = [None] * len(invoices)
+        for period, indexes in by_period.items():
+            if period is None:
+                # 沒有日期的發票要逐期尋找
+                for i in indexes:
+                    results[i] = self._check(invoices[i][0], None)
+                continue
+            if period not in self.winning_numbers:
+                not_drawn = (False, NOT_DRAWN_MSG.format(period=period))
+                for i in indexes:
+                    results[i] = not_drawn
+                continue
+            index = self._index_for(period)
+            for i in indexes:
+                results[i] = self._match(invoices[i][0], period, index) or (False, NO_PRIZE_MSG)
+        return results
 
-prize_manager = PrizeManager()
+# 第一次對獎時才開啟資料庫
+prize_manager = Lazy('prize_manager', PrizeManager)
 
 if __name__ == "__main__":
     pm = PrizeManager()
@@ -0,0 +1,78 @@
+"""
+冷啟動分析：以 `python -X importtime` 載入 app，依子系統 (app 直接 import 的模組) 列出載入時間，
+再量測到第一個請求完成的總時間，超過 STARTUP_BUDGET_MS 時以非 0 結束 (可放進 CI)
+
+    python startup_profile.py
+"""
+import os
+import re
+import subprocess
+import sys
+from config import STARTUP_BUDGET_MS
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# 在子程序中載入 app 並送出第一個請求，印出各階段耗時 (毫秒)
+PROBE = """
+import time
+started = time.perf_counter()
+import app
+loaded = time.perf_counter()
+app.app.test_client().get("/")
+done = time.perf_counter()
+print("IMPORT_MS", (loaded - started) * 1000)
+print("FIRST_REQUEST_MS", (done - started) * 1000)
+"""
+
+
+def parse_importtime(stderr, root="app"):
+    """
+    回傳 {子系統: 累計微秒}，只計 root 直接 import 的模組 (其下的相依套件算在它身上)
+    """
+    # importtime 先印子模組再印父模組，所以 root 之前、縮排多一層的就是它直接 import 的模組
+    subsystems = {}
+    for m in (IMPORT_LINE.match(l) for l in stderr.splitlines()):
+        if not m:
+            continue
+        indent, name = len(m.group(3)), m.group(4)
+        if indent == 1:
+            if name == root:
+                return subsystems
+            subsystems = {}  # 直譯器啟動或其他頂層模組，重新計算
+        elif indent == 3:
+            subsystems[name] = int(m.group(2))
+    return {}
+
+
+def profile():
+    env = dict(os.environ)
+    # 只需要能載入 app，不會真的連線
+    env.setdefault("LINE_CHANNEL_SECRET", "profile")
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "profile")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(result.returncode)
+
+    timings = {}
+    for line in result.stdout.splitlines():
+        if line.startswith(("IMPORT_MS", "FIRST_REQUEST_MS")):
+            key, value = line.split()
+            timings[key] = float(value)
+    subsystems = parse_importtime(result.stderr)
+
+    print("各子系統載入時間：")
+    for name, us in sorted(subsystems.items(), key=lambda kv: kv[1], reverse=True)[:15]:
+        print(f"  {name:<24} {us / 1000:>8.1f} ms")
+    import_ms = timings.get("IMPORT_MS", 0)
+    first_ms = timings.get("FIRST_REQUEST_MS", 0)
+    print(f"載入 app：{import_ms:.0f} ms")
+    print(f"第一個請求完成：{first_ms:.0f} ms (預算 {STARTUP_BUDGET_MS} ms)")
+    return first_ms <= STARTUP_BUDGET_MS
+
+
+if __name__ == "__main__":
+    sys.exit(0 if profile() else 1)
@@ -0,0 +1,72 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+from linebot.models.error import Error
+
+import leader_election
+from benchmarks.fakes import FakeLineBotApi
+
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test")
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test")
+
+
+@pytest.fixture(scope="module")
+def app_module():
+    # 不啟動排程 (不連網路)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(leader_election.LeaderElection, "start", lambda self, on_elected: None)
+        import app
+    return app
+
+
+def make_event(age_seconds=0):
+    return SimpleNamespace(
+        timestamp=(time.time() - age_seconds) * 1000,
+        reply_token="token",
+        source=SimpleNamespace(user_id="U1"),
+    )
+
+
+def test_send_reply_uses_fresh_reply_token(app_module, monkeypatch):
+    line = FakeLineBotApi()
+    monkeypatch.setattr(app_module, "line_bot_api", line)
+    app_module.send_reply(make_event(), TextSendMessage(text="ok"))
+    assert len(line.replies) == 1 and line.pushes == []
+
+
+def test_send_reply_pushes_when_token_is_stale(app_module, monkeypatch):
+    line = FakeLineBotApi()
+    monkeypatch.setattr(app_module, "line_bot_api", line)
+    app_module.send_reply(make_event(age_seconds=app_module.REPLY_TOKEN_TTL + 5), TextSendMessage(text="ok"))
+    assert line.replies == [] and line.pushes[0][0] == "U1"
+
+
+def test_send_reply_pushes_when_token_rejected(app_module, monkeypatch):
+    rejected = LineBotApiError(400, {}, error=Error(message="Invalid reply token"))
+    line = FakeLineBotApi(reply_error=rejected)
+    monkeypatch.setattr(app_module, "line_bot_api", line)
+    app_module.send_reply(make_event(), TextSendMessage(text="ok"))
+    assert len(line.pushes) == 1
+
+    # 其他錯誤照常拋出，不改用 push
+    line = FakeLineBotApi(reply_error=LineBotApiError(500, {}, error=Error(message="Internal error")))
+    monkeypatch.setattr(app_module, "line_bot_api", line)
+    with pytest.raises(LineBotApiError):
+        app_module.send_reply(make_event(), TextSendMessage(text="ok"))
+    assert line.pushes == []
+
+
+def test_callback_handles_inline_when_queue_is_full(app_module, monkeypatch):
+    handled = []
+    monkeypatch.setattr(app_module.handler.parser.signature_validator, "validate", lambda body, signature: True)
+    monkeypatch.setattr(app_module.event_worker, "submit", lambda fn, *args: False)
+    monkeypatch.setattr(app_module.handler, "handle", lambda body, signature: handled.append(body))
+
+    client = app_module.app.test_client()
+    response = client.post("/callback", data='{"events": []}', headers={"X-Line-Signature": "sig"})
+    assert response.status_code == 200
+    assert handled == ['{"events": []}']
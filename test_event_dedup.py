@@ -0,0 +1,80 @@
+from linebot.models import MessageEvent
+
+from event_dedup import EventDedup, event_key, once_per_event, DONE, IN_FLIGHT
+
+
+def make_event(event_id="01HEVENT", message_id="4711", redelivery=False):
+    return MessageEvent.new_from_json_dict({
+        "type": "message", "mode": "active", "timestamp": 0, "replyToken": "t",
+        "webhookEventId": event_id, "deliveryContext": {"isRedelivery": redelivery},
+        "source": {"type": "user", "userId": "U1"},
+        "message": {"type": "text", "id": message_id, "text": "午餐 100"},
+    })
+
+
+def test_claim_short_circuits_in_flight_and_processed(tmp_path):
+    store = EventDedup(str(tmp_path / "events.db"))
+    # 另一個 worker 開的連線也看得到同一份紀錄
+    other = EventDedup(str(tmp_path / "events.db"))
+
+    assert store.claim("e1")
+    assert store.state("e1") == IN_FLIGHT
+    assert not other.claim("e1")
+
+    store.done("e1")
+    assert store.state("e1") == DONE
+    assert not other.claim("e1")
+
+    store.claim("e2")
+    store.release("e2")
+    assert other.claim("e2")
+
+
+def test_expired_entries_can_be_claimed_and_store_is_bounded(tmp_path):
+    store = EventDedup(str(tmp_path / "events.db"), ttl=0, in_flight_ttl=0, max_entries=10)
+    assert store.claim("e1")
+    assert store.claim("e1")
+
+    store.ttl = store.in_flight_ttl = 3600
+    # 每 PRUNE_EVERY 次 claim 清理一次
+    for i in range(EventDedup.PRUNE_EVERY - 2):
+        store.claim(f"k{i}")
+    assert store.conn.execute("SELECT COUNT(*) FROM webhook_events").fetchone()[0] <= 10
+
+
+def test_redelivered_event_runs_handler_once(tmp_path):
+    store = EventDedup(str(tmp_path / "events.db"))
+    calls = []
+
+    @once_per_event(store)
+    def handle(event):
+        calls.append(event.message.text)
+
+    handle(make_event())
+    handle(make_event(redelivery=True))
+    assert calls == ["午餐 100"]
+
+    # 沒有 webhookEventId 時以訊息 ID 判斷
+    legacy = make_event(event_id=None, message_id="99")
+    assert event_key(legacy) == "message:99"
+    handle(legacy)
+    handle(legacy)
+    assert len(calls) == 2
+
+
+def test_failed_handler_releases_event(tmp_path):
+    store = EventDedup(str(tmp_path / "events.db"))
+    attempts = []
+
+    @once_per_event(store)
+    def handle(event):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("Sheets down")
+
+    try:
+        handle(make_event())
+    except RuntimeError:
+        pass
+    handle(make_event(redelivery=True))
+    assert len(attempts) == 2
@@ -0,0 +1,33 @@
+import threading
+
+from event_worker import EventWorker
+
+
+def test_full_pool_rejects_new_work():
+    worker = EventWorker(max_workers=1, max_pending=1)
+    release = threading.Event()
+    try:
+        assert worker.submit(release.wait)
+        assert worker.submit(release.wait)
+        # 執行中 1 + 排隊 1 都滿了，呼叫端要自己同步處理
+        assert not worker.submit(release.wait)
+    finally:
+        release.set()
+        worker.shutdown()
+
+
+def test_slot_released_when_handler_raises():
+    worker = EventWorker(max_workers=1, max_pending=0)
+    ran = []
+
+    def boom():
+        raise RuntimeError("Gemini down")
+
+    try:
+        assert worker.submit(boom)
+        # 單一執行緒依序執行，這個工作跑完時 boom 的 finally 已經釋放名額
+        worker.executor.submit(lambda: None).result()
+        assert worker.submit(ran.append, 1)
+    finally:
+        worker.shutdown()
+    assert ran == [1]
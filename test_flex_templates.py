@@ -0,0 +1,58 @@
+from linebot.models import FlexSendMessage
+
+import line_handler
+from flex_templates import FlexTemplate, Slot, box, text
+from line_handler import LineHandler
+
+
+class FakePrizeManager:
+    def check_prize(self, invoice_number, invoice_date=None):
+        return True, "🧧 200元 (六獎)！"
+
+
+def test_template_shares_static_subtrees():
+    template = FlexTemplate(box('vertical', [
+        text('固定標題', size='sm'),
+        text(Slot('value'), size='xs'),
+    ]))
+    a = template.render(value='1')
+    b = template.render(value='2')
+    assert a['contents'][1]['text'] == '1' and b['contents'][1]['text'] == '2'
+    # 沒有變動欄位的子樹不會重新建立
+    assert a['contents'][0] is b['contents'][0]
+
+
+def test_builders_produce_valid_flex_wire_format(monkeypatch):
+    monkeypatch.setattr(line_handler, "prize_manager", FakePrizeManager())
+    summary = {
+        'title': '消費月報', 'month': '2024-02', 'total': 6000.0, 'count': 2,
+        'category_details': {'餐飲': 1000.0, '交通': 5000.0}, 'budget': 5000.0, 'remaining': -1000.0,
+        'items': [{'date': '2024-02-03 12:00:00', 'category': '餐飲', 'amount': 1000.0}],
+    }
+    messages = [
+        LineHandler.get_summary_flex(summary),
+        LineHandler.get_batch_summary_flex([{'category': '早餐', 'amount': 50}] * 7),
+        LineHandler.get_flex_message({'category': '午餐', 'amount': 80, 'date': '2024-02-01', 'invoice_number': '12345678'}),
+    ]
+    for message in messages:
+        payload = message.as_json_dict()
+        # 用 SDK 解析再序列化，結果必須完全相同
+        assert FlexSendMessage.new_from_json_dict(payload).as_json_dict() == payload
+
+    summary_bubble = messages[0].as_json_dict()['contents']
+    bar = summary_bubble['body']['contents'][2]['contents'][1]['contents'][0]
+    assert bar['width'] == '100%' and bar['backgroundColor'] == '#FF6B6B'
+    assert len(messages[1].as_json_dict()['contents']['body']['contents'][5]['contents']) == 6
+
+
+def test_detail_page_carousel_with_next_postback():
+    items = [{'date': f'2024-02-{d:02d}', 'category': '餐飲', 'amount': d} for d in range(1, 26)]
+    page = {'month': '2024-02', 'items': items, 'next_cursor': '2024-02-25|30'}
+    payload = LineHandler.get_detail_page_flex("2024-02 個人明細", page, start=61).as_json_dict()
+    assert FlexSendMessage.new_from_json_dict(payload).as_json_dict() == payload
+
+    bubbles = payload['contents']['contents']
+    assert len(bubbles) == 2 and 'footer' not in bubbles[0]
+    action = bubbles[-1]['footer']['contents'][1]['action']
+    data = LineHandler.parse_postback(action['data'])
+    assert data == {'action': 'detail', 'scope': 'me', 'month': '2024-02', 'cursor': '2024-02-25|30', 'start': '86'}
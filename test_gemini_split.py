@@ -0,0 +1,84 @@
+import io
+import json
+import threading
+from pypdf import PdfWriter
+from PIL import Image
+from gemini_manager import GeminiManager
+from media_buffer import MediaBuffer
+
+
+class PageModel:
+    """
+    每段回傳一筆不同的交易，並記錄呼叫次數
+    """
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+
+        class Response:
+            text = json.dumps([{"category": "購物", "amount": n * 100, "note": "", "date": "2024-02-01"}])
+        return Response()
+
+
+def make_media(data):
+    return MediaBuffer.from_chunks([data], spool_bytes=10 * 1024 * 1024, max_bytes=20 * 1024 * 1024)
+
+
+def test_multi_page_pdf_parsed_per_page(tmp_path):
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=200, height=200)
+    buf = io.BytesIO()
+    writer.write(buf)
+
+    gm = GeminiManager(cache_path=str(tmp_path / "cache.db"))
+    gm.model = PageModel()
+    with make_media(buf.getvalue()) as media:
+        records = gm.parse_bookkeeping_content(media=media, mime_type="application/pdf")
+    assert gm.model.calls == 3
+    assert sorted(r['amount'] for r in records) == [100, 200, 300]
+
+
+def test_tall_screenshot_split_into_strips(tmp_path):
+    buf = io.BytesIO()
+    Image.new("RGB", (100, 700), "white").save(buf, "JPEG")
+    gm = GeminiManager(cache_path=str(tmp_path / "cache.db"))
+    parts = gm._split_media(make_media(buf.getvalue()), "image/jpeg")
+    assert len(parts) == 4
+    assert all(mime == "image/jpeg" for mime, _ in parts)
+
+
+def test_merge_drops_duplicates_from_adjacent_parts_only():
+    a = {"category": "餐飲", "amount": 80, "note": "", "date": "2024-02-01"}
+    b = {"category": "交通", "amount": 30, "note": "", "date": "2024-02-02"}
+    merged = GeminiManager._merge_parts([[a, b], [b], [a]], overlap=True)
+    assert merged == [a, b, a]
+
+
+class SameFareModel:
+    """
+    每一頁都回傳同一天、同金額的車資 (帳單上真的有兩筆)
+    """
+    def generate_content(self, contents):
+        class Response:
+            text = json.dumps([{"category": "交通", "amount": 30, "note": "", "date": "2024-02-01"}])
+        return Response()
+
+
+def test_pdf_pages_keep_identical_transactions(tmp_path):
+    writer = PdfWriter()
+    for _ in range(2):
+        writer.add_blank_page(width=200, height=200)
+    buf = io.BytesIO()
+    writer.write(buf)
+
+    gm = GeminiManager(cache_path=str(tmp_path / "cache.db"))
+    gm.model = SameFareModel()
+    with make_media(buf.getvalue()) as media:
+        records = gm.parse_bookkeeping_content(media=media, mime_type="application/pdf")
+    assert len(records) == 2
@@ -0,0 +1,35 @@
+import io
+from PIL import Image
+from image_preprocess import preprocess_receipt
+
+
+def make_photo(size=(4000, 3000), orientation=None):
+    img = Image.new("RGB", size, (40, 40, 40))          # 深色桌面
+    img.paste((250, 250, 245), (1500, 300, 2500, 2700))  # 收據
+    buf = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(buf, "JPEG", quality=95, exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def test_receipt_is_cropped_grayscaled_and_downscaled():
+    data = make_photo()
+    out, stats = preprocess_receipt(data, max_edge=1600, quality=75)
+    img = Image.open(io.BytesIO(out))
+    assert img.mode == "L"
+    assert max(img.size) <= 1600
+    assert stats["cropped"]
+    # 收據是直的 (1000x2400)，裁切後也應該是直的
+    assert img.size[1] > img.size[0] * 2
+    assert stats["bytes_after"] < stats["bytes_before"]
+
+
+def test_exif_rotation_applied():
+    data = make_photo(size=(3000, 4000), orientation=6)
+    out, stats = preprocess_receipt(data)
+    assert stats["size_before"] == (3000, 4000)
+    # 旋轉 90 度後，原本直的收據變成橫的
+    img = Image.open(io.BytesIO(out))
+    assert img.size[0] > img.size[1]
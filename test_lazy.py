@@ -0,0 +1,31 @@
+import threading
+import time
+
+from lazy import Lazy, STARTUP_TIMINGS
+
+
+def test_lazy_creates_once_across_threads():
+    created = []
+
+    class Client:
+        value = 42
+
+    def factory():
+        time.sleep(0.05)
+        created.append(1)
+        return Client()
+
+    client = Lazy('test_client', factory)
+    assert not client.initialized
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.value)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [42] * 8
+    assert len(created) == 1
+    assert client.initialized
+    assert 'test_client' in STARTUP_TIMINGS
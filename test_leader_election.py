@@ -0,0 +1,35 @@
+import threading
+
+from leader_election import LeaderElection
+
+
+def test_only_one_leader_and_failover(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    a = LeaderElection(path)
+    b = LeaderElection(path)
+
+    assert a.try_acquire()
+    assert not b.try_acquire()
+    assert a.is_leader and not b.is_leader
+
+    # leader 釋放 (程序結束時由作業系統釋放) 後另一個 worker 接手
+    a.release()
+    assert b.try_acquire()
+    b.release()
+
+
+def test_start_calls_on_elected_after_leader_dies(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    leader = LeaderElection(path)
+    assert leader.try_acquire()
+
+    elected = threading.Event()
+    follower = LeaderElection(path, retry_interval=0.05)
+    thread = follower.start(elected.set)
+    assert not elected.wait(0.2)
+
+    leader.release()
+    assert elected.wait(2)
+    thread.join(2)
+    assert follower.is_leader
+    follower.stop()
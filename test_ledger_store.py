@@ -0,0 +1,272 @@
+from datetime import datetime
+import gspread
+import gsheet_manager
+from gsheet_manager import GSheetManager, LedgerSchema
+from ledger_store import LedgerRow, LedgerStore
+from benchmarks.fakes import FakeWorksheet, FakeSheetsClient
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ""
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}}
+
+
+def make_manager(tmp_path, rows=None):
+    gm = GSheetManager(db_path=str(tmp_path / "ledger.db"))
+    sheet = FakeWorksheet(rows)
+    gm.client = FakeSheetsClient(sheet)
+    return gm, sheet
+
+
+def test_summary_reads_local_mirror(tmp_path):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path, [
+        [f"{month}-01", "早餐", 100, "", "U1", ""],
+        [f"{month}-02", "午餐", 150, "便當", "U2", ""],
+    ])
+
+    summary = gm.get_summary("U1")
+    assert summary['total'] == 100
+    assert sheet.full_reads == 1
+
+    # 新增資料走 write-through，之後只需讀取尾端，不需重讀整張試算表
+    gm.add_records([{'date': f"{month}-03", 'category': '早餐', 'amount': 50, 'note': ''}], "U1")
+    summary = gm.get_summary("U1")
+    assert summary['total'] == 150
+    assert summary['category_details'] == {'早餐': 150}
+    assert sheet.full_reads == 1
+
+    family = gm.get_summary(["U1", "U2"], is_family=True)
+    assert family['count'] == 3
+    assert family['title'].endswith("家庭合併報表")
+
+
+def test_forced_sync_picks_up_manual_edits(tmp_path):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path, [[f"{month}-01", "早餐", 100, "", "U1", ""]])
+    gm.get_summary("U1")
+
+    # 使用者直接在 Google Sheets 改了金額
+    sheet.values[1][2] = 80
+    gm.sync(force=True)
+    assert gm.get_summary("U1")['total'] == 80
+
+
+def test_tail_sync_fetches_only_new_rows(tmp_path):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path, [[f"{month}-01", "早餐", 100, "", "U1", ""]])
+    gm.get_summary("U1")
+
+    # 其他程序 (或手動) 在試算表尾端新增資料
+    sheet.values.append([f"{month}-02", "晚餐", 200, "", "U1", "12345678"])
+    assert gm.get_summary("U1")['total'] == 300
+    assert sheet.full_reads == 1
+    assert [r['invoice_number'] for r in gm.get_unchecked_invoices("115年01-02月", [month, month])] == ["12345678"]
+
+
+def test_tail_sync_falls_back_when_rows_removed(tmp_path):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path, [
+        [f"{month}-01", "早餐", 100, "", "U1", ""],
+        [f"{month}-02", "午餐", 150, "", "U1", ""],
+    ])
+    gm.get_summary("U1")
+
+    del sheet.values[2]
+    assert gm.get_summary("U1")['total'] == 100
+    assert sheet.full_reads == 2
+
+    sheet.values[0] = ['日期', '類別', '金額', '備註', '使用者ID', '發票號碼']
+    gm.get_summary("U1")
+    assert sheet.full_reads == 3
+
+
+def test_rollup_tracks_writes_and_overwrites(tmp_path):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path, [
+        [f"{month}-01", "早餐", 100, "", "U1", ""],
+        [f"{month}-02", "午餐", 150, "", "U1", ""],
+    ])
+    gm.sync()
+    gm.add_records([{'date': f"{month}-03", 'category': '早餐', 'amount': 40, 'note': ''}], "U1")
+
+    rollup = [tuple(r) for r in gm.store.query_rollup(["U1"], month)]
+    assert rollup == [("早餐", 140.0, 2), ("午餐", 150.0, 1)]
+
+    # 同一列被覆蓋時要扣掉舊值
+    gm.store.upsert_rows([LedgerRow(3, f"{month}-02", "晚餐", 90, "", "U1", "")])
+    rollup = [tuple(r) for r in gm.store.query_rollup(["U1"], month)]
+    assert rollup == [("早餐", 140.0, 2), ("晚餐", 90.0, 1)]
+
+    summary = gm.get_summary("U1", include_items=False)
+    assert summary['total'] == 230
+    assert summary['count'] == 3
+    assert summary['items'] == []
+
+
+def test_worksheet_handle_cached_and_quota_errors_retried(tmp_path, monkeypatch):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path)
+    sleeps = []
+    monkeypatch.setattr(gsheet_manager.time, "sleep", sleeps.append)
+
+    original = sheet.append_rows
+    failures = [429, 429]
+
+    def flaky_append_rows(rows):
+        if failures:
+            raise gspread.exceptions.APIError(FakeResponse(failures.pop(0)))
+        return original(rows)
+
+    sheet.append_rows = flaky_append_rows
+    record = {'date': f"{month}-01", 'category': '早餐', 'amount': 60, 'note': ''}
+    assert gm.add_records([record], "U1")
+    assert gm.add_records([record], "U1")
+    assert len(sleeps) == 2
+    assert gm.client.open_calls == 1
+    assert gm.get_summary("U1")['total'] == 120
+
+
+def test_append_not_retried_on_server_error(tmp_path, monkeypatch):
+    month = datetime.now().strftime("%Y-%m")
+    gm, sheet = make_manager(tmp_path)
+    monkeypatch.setattr(gsheet_manager.time, "sleep", lambda s: None)
+
+    original = sheet.append_rows
+    calls = []
+
+    def committed_then_503(rows):
+        # Sheets 已經寫入，但回應 503
+        calls.append(rows)
+        original(rows)
+        raise gspread.exceptions.APIError(FakeResponse(503))
+
+    sheet.append_rows = committed_then_503
+    record = {'date': f"{month}-01", 'category': '早餐', 'amount': 60, 'note': ''}
+    assert not gm.add_records([record], "U1")
+    assert len(calls) == 1
+    assert len(sheet.values) == 2  # 標題 + 一列，沒有重複
+
+
+def test_schema_resolves_header_once():
+    schema = LedgerSchema(['使用者ID', '日期', '金額', '類別'])
+    row = schema.decode(7, ['U1', '2024-02-16', '150', '午餐'])
+    assert (row.row, row.user_id, row.date, row.amount, row.category) == (7, 'U1', '2024-02-16', '150', '午餐')
+    # 找不到標題的欄位依預設順序猜測，超出範圍則為 None
+    assert row.note == '午餐' and row.invoice_number is None
+
+
+def test_prize_checks_are_incremental_and_notified_once(tmp_path):
+    gm, sheet = make_manager(tmp_path, [
+        ["2024-01-05", "午餐", 100, "", "U1", "11112222"],
+        ["2024-02-10", "晚餐", 200, "", "U2", "33334444"],
+        ["2024-03-01", "早餐", 50, "", "U1", "55556666"],  # 下一期
+    ])
+    period, months = "113年01-02月", ["2024-01", "2024-02"]
+    invoices = gm.get_unchecked_invoices(period, months)
+    assert [r['invoice_number'] for r in invoices] == ["11112222", "33334444"]
+
+    gm.store.record_prize_results(period, [
+        ("U1", "11112222", "2024-01-05", "🧧 200元 (六獎)！"),
+        ("U2", "33334444", "2024-02-10", None),
+    ])
+    assert gm.get_unchecked_invoices(period, months) == []
+
+    # 帳本沒有變動：這一期已記錄為對完，不再掃描發票
+    scans = []
+    gm.store.conn.set_trace_callback(lambda sql: scans.append(sql) if "prize_checked c" in sql else None)
+    assert gm.get_unchecked_invoices(period, months) == []
+    # 全量對帳或新增沒有發票的紀錄也不影響
+    gm.sync(force=True)
+    gm.add_records([{'date': "2024-02-11", 'category': '午餐', 'amount': 90, 'note': ''}], "U1")
+    assert gm.get_unchecked_invoices(period, months) == []
+    gm.store.conn.set_trace_callback(None)
+    assert scans == []
+
+    # 之後新增的發票才需要再對
+    sheet.values.append(["2024-02-20", "購物", 300, "", "U2", "77778888"])
+    assert [r['invoice_number'] for r in gm.get_unchecked_invoices(period, months)] == ["77778888"]
+
+    pending = gm.store.pending_notifications()
+    assert [(r['user_id'], r['invoice_number']) for r in pending] == [("U1", "11112222")]
+    gm.store.mark_notified(pending)
+    assert gm.store.pending_notifications() == []
+
+
+def test_items_page_walks_all_rows_newest_first(tmp_path):
+    gm, sheet = make_manager(tmp_path, [
+        [f"2024-02-{d % 28 + 1:02d} 12:00:00", "餐飲", d, "", "U1", ""] for d in range(45)
+    ] + [["2024-02-05", "交通", 999, "", "U2", ""]])
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page = gm.get_items_page("U1", month="2024-02", cursor=cursor, limit=20)
+        pages += 1
+        seen += page['items']
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert len(seen) == 45 and all(it['amount'] != 999 for it in seen)
+    dates = [it['date'] for it in seen]
+    assert dates == sorted(dates, reverse=True)
+    # 翻頁只讀本地索引，不會再同步試算表
+    assert sheet.full_reads == 1 and sheet.tail_reads == 0
+
+
+def test_category_page_uses_category_index(tmp_path):
+    gm, _ = make_manager(tmp_path, [
+        ["2024-02-01", "餐飲", 100, "", "U1", ""],
+        ["2024-02-02", "交通", 50, "", "U1", ""],
+        ["2024-02-03", "餐飲", 80, "", "U1", ""],
+        ["2024-01-03", "餐飲", 70, "", "U1", ""],
+    ])
+    page = gm.get_items_page("U1", month="2024-02", category="餐飲")
+    assert [it['amount'] for it in page['items']] == [80, 100]
+    assert page['next_cursor'] is None
+
+    plan = gm.store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT row FROM ledger WHERE user_id IN (?) AND month = ? AND category = ? "
+        "ORDER BY date DESC, row DESC", ("U1", "2024-02", "餐飲")
+    ).fetchall()
+    assert any("idx_ledger_user_month_category" in r[-1] for r in plan)
+
+
+def test_family_summary_merges_memoized_member_rollups(tmp_path):
+    month = datetime.now().strftime("%Y-%m")
+    gm, _ = make_manager(tmp_path, [
+        [f"{month}-01", "餐飲", 100, "", "U1", ""],
+        [f"{month}-02", "交通", 50, "", "U2", ""],
+        [f"{month}-03", "餐飲", 30, "", "U2", ""],
+    ])
+    assert gm.get_summary("U1", include_items=False)['total'] == 100
+    assert set(gm.store._member_cache) == {("U1", month)}
+
+    family = gm.get_summary(["U1", "U2"], is_family=True, include_items=False)
+    assert family['category_details'] == {"餐飲": 130, "交通": 50}
+    assert family['count'] == 3
+
+    # 寫入只讓該成員的結果失效
+    gm.add_record(f"{month}-04", "交通", 20, "", "U2")
+    assert set(gm.store._member_cache) == {("U1", month)}
+    assert gm.get_summary(["U1", "U2"], is_family=True, include_items=False)['total'] == 200
+
+    # 其他程序寫入時 (data_version 改變) 全部重新讀取
+    other = LedgerStore(str(tmp_path / "ledger.db"))
+    other.upsert_rows([LedgerRow(99, f"{month}-05", "餐飲", 1, "", "U1")])
+    assert gm.get_summary("U1", include_items=False)['total'] == 101
+
+
+def test_sheets_calls_are_counted(tmp_path):
+    import metrics
+    gm, _ = make_manager(tmp_path)
+    before = metrics.SHEETS_CALLS.value(stage='sheets_append')
+    gm.add_record("2024-02-01", "早餐", 50, "", "U1")
+    assert metrics.SHEETS_CALLS.value(stage='sheets_append') == before + 1
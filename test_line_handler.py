@@ -0,0 +1,59 @@
+from line_handler import LineHandler, parse_amount
+
+
+def simple(records):
+    return [(r['category'], r['amount'], r['note']) for r in records] if records else records
+
+
+def test_parse_amount_chinese_numerals():
+    assert parse_amount("150") == 150
+    assert parse_amount("150元") == 150
+    assert parse_amount("1,200") == 1200
+    assert parse_amount("一千二") == 1200
+    assert parse_amount("3千5") == 3500
+    assert parse_amount("兩百五") == 250
+    assert parse_amount("一百零五") == 105
+    assert parse_amount("十五") == 15
+    assert parse_amount("1.5萬") == 15000
+    assert parse_amount("十萬") == 100000
+    assert parse_amount("五十萬") == 500000
+    assert parse_amount("一百萬") == 1000000
+    assert parse_amount("兩千萬") == 20000000
+    assert parse_amount("三萬五千") == 35000
+    assert parse_amount("三明治") is None
+
+
+def test_parse_message_simple_entries():
+    assert simple(LineHandler.parse_message("早餐 100")) == [("早餐", 100, "")]
+    assert simple(LineHandler.parse_message("100 晚餐")) == [("晚餐", 100, "")]
+    assert simple(LineHandler.parse_message("午餐 150 今天很熱")) == [("午餐", 150, "今天很熱")]
+    assert simple(LineHandler.parse_message("午餐150元")) == [("午餐", 150, "")]
+    assert simple(LineHandler.parse_message("三明治 60")) == [("三明治", 60, "")]
+    assert simple(LineHandler.parse_message("計程車 3千5")) == [("計程車", 3500, "")]
+    assert simple(LineHandler.parse_message("計程車 1,250 機場")) == [("計程車", 1250, "機場")]
+
+
+def test_parse_message_multiple_items():
+    expected = [("早餐", 50, ""), ("午餐", 120, "")]
+    assert simple(LineHandler.parse_message("早餐 50 午餐 120")) == expected
+    assert simple(LineHandler.parse_message("早餐 50，午餐 120")) == expected
+    assert simple(LineHandler.parse_message("早餐 50,午餐 120")) == expected
+
+
+def test_parse_message_defers_to_gemini_when_unsure():
+    assert LineHandler.parse_message("今天吃大餐花了一千") is None
+    assert LineHandler.parse_message("晚餐 200 昨天") is None
+    assert LineHandler.parse_message("100") is None
+    assert LineHandler.parse_message("早餐 50 100") is None
+
+
+def test_parse_message_rejects_quantities():
+    # 數字加量詞是數量，不能當成「金額 + 類別」
+    assert LineHandler.parse_message("咖啡 2杯 130") is None
+    assert LineHandler.parse_message("停車 1小時 40") is None
+    assert LineHandler.parse_message("電影 2張 500") is None
+    assert LineHandler.parse_message("3個 便當 270") is None
+    assert LineHandler.parse_message("買 3 個蘋果 90") is None
+    assert LineHandler.parse_message("咖啡 2 杯 130") is None
+    # 有標示幣別的黏寫照常拆開
+    assert simple(LineHandler.parse_message("100元早餐")) == [("早餐", 100, "")]
@@ -0,0 +1,74 @@
+import io
+import json
+import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from log_setup import DeferredQueueHandler, JsonFormatter, RequestIdFilter, mask_user, new_request_id, request_id, submit_with_context
+
+
+def test_json_formatter_includes_request_id_and_extra():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RequestIdFilter())
+    log = logging.getLogger('test_log_setup.json')
+    log.addHandler(handler)
+    log.propagate = False
+    try:
+        rid = new_request_id()
+        log.warning("Webhook received %d", 3, extra={'bytes': 120})
+    finally:
+        log.removeHandler(handler)
+
+    data = json.loads(stream.getvalue())
+    assert data['msg'] == "Webhook received 3"
+    assert data['level'] == 'WARNING'
+    assert data['request_id'] == rid
+    assert data['bytes'] == 120
+
+
+def test_queue_defers_formatting_to_listener():
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, output)
+
+    log = logging.getLogger('test_log_setup.queue')
+    log.addHandler(queue_handler)
+    log.propagate = False
+    listener.start()
+    try:
+        rid = new_request_id()
+        try:
+            raise ValueError("bad receipt")
+        except ValueError:
+            log.exception("Parse failed for %s", "image")
+    finally:
+        listener.stop()
+        log.removeHandler(queue_handler)
+
+    data = json.loads(stream.getvalue())
+    assert data['msg'] == "Parse failed for image"
+    assert data['request_id'] == rid
+    assert 'ValueError: bad receipt' in data['exc']
+
+
+def test_submit_with_context_carries_request_id():
+    rid = new_request_id()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [submit_with_context(pool, request_id.get) for _ in range(4)]
+        assert [f.result() for f in futures] == [rid] * 4
+        # 沒帶 context 的工作看不到 request ID
+        assert pool.submit(request_id.get).result() == '-'
+
+
+def test_mask_user_hides_raw_id():
+    masked = mask_user('U1234567890abcdef')
+    assert masked.startswith('u:') and '1234567890' not in masked
+    assert masked == mask_user('U1234567890abcdef')
+    assert mask_user(None) == '-'
@@ -0,0 +1,27 @@
+import hashlib
+import os
+import pytest
+from media_buffer import MediaBuffer, MediaTooLarge
+
+
+def test_small_media_stays_in_memory():
+    chunks = [b"abc", b"def"]
+    with MediaBuffer.from_chunks(chunks, spool_bytes=100, max_bytes=1000) as media:
+        assert media.in_memory
+        assert media.getvalue() == b"abcdef"
+        assert media.digest == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_large_media_spills_to_disk_and_is_cleaned_up():
+    chunks = [b"x" * 60, b"y" * 60]
+    media = MediaBuffer.from_chunks(chunks, spool_bytes=100, max_bytes=1000, suffix=".pdf")
+    assert not media.in_memory
+    assert media.getvalue() == b"x" * 60 + b"y" * 60
+    path = media.path
+    media.close()
+    assert not os.path.exists(path)
+
+
+def test_hard_size_limit():
+    with pytest.raises(MediaTooLarge):
+        MediaBuffer.from_chunks([b"x" * 600, b"y" * 600], spool_bytes=100, max_bytes=1000)
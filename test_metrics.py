@@ -0,0 +1,32 @@
+import pytest
+
+import metrics
+from metrics import Counter, Histogram, span
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = Histogram('test_seconds', 'test', ['stage'], buckets=(0.1, 1))
+    h.observe(0.05, stage='a')
+    h.observe(0.5, stage='a')
+    h.observe(3, stage='a')
+    lines = h.render()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+
+
+def test_counter_escapes_label_values():
+    c = Counter('test_total', 'test', ['path'])
+    c.inc(path='a"b')
+    assert 'test_total{path="a\\"b"} 1' in c.render()
+
+
+def test_span_counts_errors():
+    before = metrics.ERRORS.value(stage='test_stage')
+    with pytest.raises(ValueError):
+        with span('test_stage'):
+            raise ValueError()
+    assert metrics.ERRORS.value(stage='test_stage') == before + 1
+    assert metrics.STAGE_SECONDS.count(stage='test_stage') >= 1
+    assert 'bookeep_stage_seconds_count{stage="test_stage"}' in metrics.render()
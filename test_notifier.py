@@ -0,0 +1,66 @@
+from notifier import NotificationDispatcher, TokenBucket
+
+
+class FakeError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def win(user_id, invoice_number):
+    return {'user_id': user_id, 'invoice_number': invoice_number, 'period': "113年01-02月",
+            'date': "2024-01-10", 'prize': "🧧 200元 (六獎)！"}
+
+
+def make_dispatcher(send):
+    return NotificationDispatcher(
+        send=send,
+        build_message=lambda user_id, items: [n['invoice_number'] for n in items],
+        max_workers=2, rate=1000, max_retries=2, backoff=0
+    )
+
+
+def test_groups_wins_by_user():
+    sent = []
+    dispatcher = make_dispatcher(lambda user_id, message: sent.append((user_id, message)))
+    delivered, stats = dispatcher.dispatch([win("U1", "11111111"), win("U2", "22222222"), win("U1", "33333333")])
+
+    assert sorted(sent) == [("U1", ["11111111", "33333333"]), ("U2", ["22222222"])]
+    assert len(delivered) == 3
+    assert stats['users'] == 2 and stats['sent'] == 2 and stats['failed'] == 0
+
+
+def test_retries_transient_errors_only():
+    calls = {"U1": 0, "U2": 0}
+
+    def send(user_id, message):
+        calls[user_id] += 1
+        if user_id == "U1" and calls[user_id] == 1:
+            raise FakeError(429)
+        if user_id == "U2":
+            raise FakeError(400)
+
+    delivered, stats = make_dispatcher(send).dispatch([win("U1", "11111111"), win("U2", "22222222")])
+
+    # 429 重試後成功；400 不重試，也不算送達 (下次排程會再試)
+    assert [n['user_id'] for n in delivered] == ["U1"]
+    assert calls == {"U1": 2, "U2": 1}
+    assert stats['retries'] == 1 and stats['failed'] == 1
+
+
+def test_token_bucket_limits_rate(monkeypatch):
+    now = [0.0]
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr("notifier.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("notifier.time.sleep", fake_sleep)
+    bucket = TokenBucket(rate=2)
+    for _ in range(4):
+        bucket.acquire()
+
+    # 前兩個 token 立即取得，之後每個要等 0.5 秒
+    assert sum(sleeps) == 1.0
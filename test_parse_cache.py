@@ -0,0 +1,40 @@
+import parse_cache
+from parse_cache import ParseCache
+from gemini_manager import GeminiManager
+from benchmarks.fakes import FakeGeminiModel
+
+
+def test_repeated_content_skips_gemini(tmp_path):
+    gm = GeminiManager(cache_path=str(tmp_path / "cache.db"))
+    gm.model = FakeGeminiModel()
+
+    first = gm.parse_bookkeeping_content(text_content="今天午餐花了 150 元")
+    second = gm.parse_bookkeeping_content(text_content="今天午餐花了　150 元 ")
+    assert first == second
+    assert gm.model.calls == 1
+
+    receipt = tmp_path / "receipt.jpg"
+    receipt.write_bytes(b"fake-jpeg")
+    gm.parse_bookkeeping_content(content_path=str(receipt), mime_type="image/jpeg")
+    gm.parse_bookkeeping_content(content_path=str(receipt), mime_type="image/jpeg")
+    assert gm.model.calls == 2
+
+
+def test_ttl_and_lru_eviction(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / "cache.db"), max_bytes=60, ttl=100)
+    clock = [1000.0]
+    monkeypatch.setattr(parse_cache.time, "time", lambda: clock[0])
+
+    cache.put("a", ["x" * 20])
+    clock[0] += 1
+    cache.put("b", ["y" * 20])
+    clock[0] += 1
+    assert cache.get("a") is not None  # a 變成最近使用
+
+    clock[0] += 1
+    cache.put("c", ["z" * 20])  # 超過 60 bytes，淘汰最久沒用的 b
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    clock[0] += 200
+    assert cache.get("c") is None
@@ -0,0 +1,102 @@
+import os
+from datetime import date
+import pytest
+import prize_manager as prize_module
+from prize_manager import PrizeManager
+from benchmarks.fakes import EtaxResponse
+
+PERIOD = "113年01-02月"
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "etax_winning_numbers.html")
+
+
+class FakeDate(date):
+    @classmethod
+    def today(cls):
+        return cls(2024, 3, 1)
+
+
+@pytest.fixture(autouse=True)
+def frozen_today(monkeypatch):
+    monkeypatch.setattr(prize_module, "date", FakeDate)
+
+
+def make_manager(tmp_path):
+    pm = PrizeManager(db_path=str(tmp_path / "prize.db"))
+    pm.save_period(PERIOD, {'special': '12345678', 'grand': '87654321', 'first': ['11112222', '33334444', '55556222']})
+    pm.save_period("112年11-12月", {'special': '00000001', 'grand': '00000002', 'first': ['99990000']})
+    return pm
+
+
+def test_check_prize_tiers(tmp_path):
+    pm = make_manager(tmp_path)
+    date = "2024-02-16"
+    assert pm.check_prize('12345678', date) == (True, f"🎉 1000萬 (特別獎)！太強了！\n({PERIOD})")
+    assert pm.check_prize('87654321', date)[1].startswith("🎊 200萬")
+    assert pm.check_prize('11112222', date)[1].startswith("💰 20萬元")
+    assert pm.check_prize('01112222', date)[1].startswith("💰 4萬元")
+    assert pm.check_prize('00006222', date)[1].startswith("💰 1千元")
+    # 兩組頭獎末三碼相同時取最高獎項
+    assert pm.check_prize('05556222', date)[1].startswith("💰 4萬元")
+    assert pm.check_prize('00000222', date)[1].startswith("🧧 200元")
+    assert pm.check_prize('00000123', date) == (False, "再接再厲，下一張就會中！💪")
+    # 不同期別的號碼不算
+    assert pm.check_prize('99990000', date)[0] is False
+    assert pm.check_prize('99990000', "2023-11-05")[0] is True
+    assert "尚未開獎" in pm.check_prize('11112222', "2024-05-01")[1]
+
+
+def test_check_prizes_batch_matches_single_checks(tmp_path):
+    pm = make_manager(tmp_path)
+    invoices = [
+        ('11112222', '2024-02-16'), ('99990000', '2023-12-31 10:00:00'),
+        ('00000123', '2024-01-02'), ('11112222', '2024-05-01'), ('00000222', None),
+    ]
+    assert pm.check_prizes_batch(invoices) == [pm.check_prize(n, d) for n, d in invoices]
+
+
+def test_fetch_is_conditional_and_persisted(tmp_path, monkeypatch):
+    with open(FIXTURE, encoding="utf-8") as f:
+        html = f.read()
+    calls = []
+
+    def fake_get(url, headers=None, timeout=None):
+        calls.append((headers, timeout))
+        if headers.get('If-None-Match') == '"v1"':
+            return EtaxResponse(304)
+        return EtaxResponse(200, html, {'ETag': '"v1"'})
+
+    monkeypatch.setattr(prize_module.requests, "get", fake_get)
+    db_path = str(tmp_path / "prize.db")
+    pm = PrizeManager(db_path=db_path)
+    assert pm.fetch_winning_numbers(force=True)
+    assert list(pm.winning_numbers) == ["113年01-02月", "112年11-12月"]
+    assert pm.winning_numbers["113年01-02月"]['first'] == ['11112222', '33334444', '55556666']
+    assert calls[0][1] is not None
+
+    # 網頁沒變時回 304，不會重新解析
+    assert pm.fetch_winning_numbers(force=True)
+    assert calls[1][0] == {'If-None-Match': '"v1"'}
+
+    # 最近一期已在資料庫時直接略過，不連線
+    assert pm.fetch_winning_numbers()
+    assert len(calls) == 2
+
+    # 重新啟動後直接從資料庫讀取
+    restarted = PrizeManager(db_path=db_path)
+    assert restarted.check_prize('12345678', '2024-01-10')[0] is True
+    assert len(calls) == 2
+
+
+def test_expired_periods_are_dropped(tmp_path, monkeypatch):
+    pm = make_manager(tmp_path)
+    assert PrizeManager.claim_deadline("112年11-12月") == date(2024, 5, 5)
+
+    class Later(date):
+        @classmethod
+        def today(cls):
+            return cls(2024, 5, 6)
+
+    monkeypatch.setattr(prize_module, "date", Later)
+    pm._data_version = None
+    pm._load()
+    assert list(pm.winning_numbers) == [PERIOD]
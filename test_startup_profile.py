@@ -0,0 +1,13 @@
+from startup_profile import parse_importtime
+
+
+def test_parse_importtime_groups_by_direct_import():
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       100 |        100 | encodings",
+        "import time:        50 |         50 |     werkzeug.utils",
+        "import time:       200 |        250 |   flask",
+        "import time:        30 |         30 |   config",
+        "import time:        10 |        290 | app",
+    ])
+    assert parse_importtime(stderr) == {'flask': 250, 'config': 30}